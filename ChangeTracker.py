@@ -0,0 +1,128 @@
+import json
+import shutil
+from pathlib import Path
+from typing import NamedTuple, Optional, Union
+
+import loguru
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+
+class RowChanges(NamedTuple):
+    """
+    Различия строк двух загрузок листа 'Массив' по ID_ESUP: позиции строк в предыдущей и в новой загрузке
+    """
+
+    removed: np.ndarray  # строки предыдущей загрузки, которых нет в новой
+    added: np.ndarray  # строки новой загрузки, которых не было в предыдущей
+    changed_previous: np.ndarray  # измененные строки, позиции в предыдущей загрузке
+    changed: np.ndarray  # те же строки, позиции в новой загрузке
+
+
+class ChangeTracker:
+    """
+    Сравнение строк листа 'Массив' с предыдущей загрузкой по ID_ESUP и хэшу строки.
+    Последняя загрузка (строки с хэшами и накопительные счетчики DateCube) сохраняется в каталоге состояния,
+    чтобы счетчики новой загрузки пересчитывались только по добавленным, удаленным и измененным строкам.
+    """
+
+    STATE_VERSION = 1
+    HASH_COLUMN = 'ROW_HASH'
+    META_FILE = 'meta.json'
+
+    def __init__(self, state_dir: Optional[Union[str, Path]]):
+        """
+        :param state_dir: каталог состояния. None - состояние хранится только в памяти процесса
+        """
+
+        self.state_dir = None if state_dir is None else Path(state_dir)
+        self.state: Optional[tuple[DataFrame, DataFrame]] = None
+        self.logger = loguru.logger
+
+    @staticmethod
+    def row_hashes(df: DataFrame) -> np.ndarray:
+        """ Хэш значений каждой строки, не зависит от индекса """
+        return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+    def load(self, columns: list[str]) -> Optional[tuple[DataFrame, DataFrame]]:
+        """
+        Предыдущая загрузка: из памяти или из каталога состояния
+        :param columns: колонки строк текущей загрузки. Состояние с другими колонками не используется
+        :return: строки с колонкой ROW_HASH и счетчики DateCubeBuilder.counts() или None
+        """
+
+        if self.state is None and self.state_dir is not None:
+            try:
+                with open(Path(self.state_dir, self.META_FILE), encoding='utf-8') as f:
+                    meta = json.load(f)
+                if meta['version'] == self.STATE_VERSION:
+                    self.state = (pd.read_parquet(Path(self.state_dir, meta['rows'])), pd.read_parquet(Path(self.state_dir, meta['counts'])))
+            except FileNotFoundError:
+                return None
+            except Exception as ex:
+                self.logger.warning(f'Не могу прочитать предыдущую загрузку "{self.state_dir}". Ошибка: {ex}')
+                return None
+        if self.state is None or list(self.state[0].columns) != columns + [self.HASH_COLUMN]:
+            return None
+        return self.state
+
+    def save(self, rows: DataFrame, counts: DataFrame) -> None:
+        """
+        Сохраняет загрузку для сравнения со следующей. Ошибки сохранения не прерывают работу программы
+        :param rows: строки с колонкой ROW_HASH
+        :param counts: счетчики DateCubeBuilder.counts()
+        """
+
+        self.state = (rows, counts)
+        if self.state_dir is None:
+            return
+        try:
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+            self.state_dir.mkdir(parents=True)
+            rows.to_parquet(Path(self.state_dir, 'rows.parquet'), index=False)
+            counts.to_parquet(Path(self.state_dir, 'counts.parquet'), index=False)
+            # meta.json записывается последним: состояние без него считается отсутствующим
+            with open(Path(self.state_dir, self.META_FILE), 'w', encoding='utf-8') as f:
+                json.dump({'version': self.STATE_VERSION, 'rows': 'rows.parquet', 'counts': 'counts.parquet'}, f)
+        except Exception as ex:
+            self.logger.warning(f'Не могу сохранить загрузку "{self.state_dir}". Ошибка: {ex}')
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+
+    @staticmethod
+    def diff(previous: DataFrame, current: DataFrame, key: str = 'ID_ESUP') -> Optional[RowChanges]:
+        """
+        Различия строк двух загрузок по ключу и колонке ROW_HASH
+        :param previous: строки предыдущей загрузки
+        :param current: строки новой загрузки
+        :param key: колонка ключа строки
+        :return: различия или None, если ключ пустой или неуникальный и строки нельзя сопоставить
+        """
+
+        if previous[key].isna().any() or current[key].isna().any() or not previous[key].is_unique or not current[key].is_unique:
+            return None
+        # Позиция строки новой загрузки в предыдущей, -1 - новая строка
+        matched = pd.Index(previous[key]).get_indexer(current[key])
+        exists = matched >= 0
+        kept = np.zeros(len(previous), dtype=bool)
+        kept[matched[exists]] = True
+        differs = np.zeros(len(current), dtype=bool)
+        differs[exists] = previous[ChangeTracker.HASH_COLUMN].to_numpy()[matched[exists]] != current[ChangeTracker.HASH_COLUMN].to_numpy()[exists]
+        return RowChanges(removed=np.flatnonzero(~kept),
+                          added=np.flatnonzero(~exists),
+                          changed_previous=matched[differs],
+                          changed=np.flatnonzero(differs))
+
+    @staticmethod
+    def changed_columns(previous: DataFrame, current: DataFrame, columns: dict[str, str]) -> list[str]:
+        """
+        Колонки, значения которых различаются в каждой паре строк
+        :param previous: строки предыдущей загрузки
+        :param current: те же строки новой загрузки в том же порядке
+        :param columns: сравниваемые колонки и их названия в отчете
+        :return: названия колонок через запятую для каждой пары строк
+        """
+
+        differs = {column_name: pd.util.hash_pandas_object(previous[column_name], index=False).to_numpy()
+                   != pd.util.hash_pandas_object(current[column_name], index=False).to_numpy() for column_name in columns}
+        return [', '.join(name for column_name, name in columns.items() if differs[column_name][number]) for number in range(len(current))]
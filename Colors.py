@@ -1,4 +1,4 @@
-import ctypes
+import sys
 
 
 class Colors:
@@ -16,5 +16,14 @@ class Colors:
     BOLD = u'\x1b[1m'
     UNDERLINE = u'\x1b[4m'
     END = u'\x1b[0m'
-    kernel32 = ctypes.windll.kernel32
-    kernel32.SetConsoleMode(kernel32.GetStdHandle(-11), 7)
+
+    @staticmethod
+    def enable() -> None:
+        """
+        Включает обработку цветовых кодов в консоли Windows. В остальных системах консоль поддерживает их без настройки
+        """
+
+        if sys.platform == 'win32':
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetConsoleMode(kernel32.GetStdHandle(-11), 7)
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import Optional, Union
+
+import loguru
+import pandas as pd
+
+
+class DataCache:
+    """
+    Локальный кэш разобранных листов исходного файла в формате Parquet.
+    Ключ кэша: путь к файлу, размер, время изменения и хэш содержимого.
+    """
+
+    CACHE_VERSION = 3
+    META_FILE = 'meta.json'
+
+    def __init__(self, cache_dir: Union[str, Path]):
+        self.cache_dir = Path(cache_dir)
+        self.logger = loguru.logger
+
+    @staticmethod
+    def make_key(path: Union[str, Path], content: bytes) -> dict:
+        """
+        Формирует ключ кэша для исходного файла
+        :param path: путь к исходному файлу
+        :param content: содержимое исходного файла
+        :return: словарь с параметрами файла, однозначно определяющими его версию
+        """
+
+        stat = Path(path).stat()
+        return {
+            'version': DataCache.CACHE_VERSION,
+            'path': str(Path(path).resolve()),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'hash': hashlib.blake2b(content, digest_size=20).hexdigest(),
+        }
+
+    def _entry_dir(self, key: dict) -> Path:
+        return Path(self.cache_dir, hashlib.sha1(key['path'].encode('utf-8')).hexdigest())
+
+    def load(self, key: dict) -> Optional[dict[str, pd.DataFrame]]:
+        """
+        Загружает данные из кэша
+        :param key: ключ кэша, полученный из make_key
+        :return: словарь {имя листа: данные} или None, если кэш отсутствует или устарел
+        """
+
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(Path(entry_dir, self.META_FILE), encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta['key'] != key:
+                self.logger.info(f'Кэш для файла "{key["path"]}" устарел')
+                return None
+            return {sheet_name: pd.read_parquet(Path(entry_dir, file_name)) for sheet_name, file_name in meta['sheets'].items()}
+        except FileNotFoundError:
+            return None
+        except Exception as ex:
+            self.logger.warning(f'Не могу прочитать кэш "{entry_dir}". Ошибка: {ex}')
+            return None
+
+    def save(self, key: dict, data: dict[str, pd.DataFrame]) -> bool:
+        """
+        Сохраняет данные в кэш. Ошибки сохранения не прерывают работу программы
+        :param key: ключ кэша, полученный из make_key
+        :param data: словарь {имя листа: данные}
+        :return: True, если данные сохранены
+        """
+
+        entry_dir = self._entry_dir(key)
+        try:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            entry_dir.mkdir(parents=True)
+            sheets = {}
+            for number, (sheet_name, _df) in enumerate(data.items()):
+                file_name = f'{number}.parquet'
+                _df.to_parquet(Path(entry_dir, file_name), index=False)
+                sheets[sheet_name] = file_name
+            # meta.json записывается последним: кэш без него считается отсутствующим
+            with open(Path(entry_dir, self.META_FILE), 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'sheets': sheets}, f, ensure_ascii=False)
+            return True
+        except Exception as ex:
+            self.logger.warning(f'Не могу сохранить кэш "{entry_dir}". Ошибка: {ex}')
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return False
+
+    def clear(self) -> None:
+        """ Удаляет все данные из кэша """
+        self.logger.info(f'Очищаем кэш "{self.cache_dir}"')
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+def default_cache_dir(program_name: str) -> Path:
+    """
+    Каталог кэша по умолчанию: %LOCALAPPDATA% в Windows, ~/.cache в остальных системах
+    :param program_name: имя программы, используется как имя подкаталога
+    :return: путь к каталогу кэша
+    """
+
+    if sys.platform == 'win32':
+        return Path(os.environ.get('LOCALAPPDATA', Path(Path.home(), 'AppData', 'Local')), program_name, 'cache')
+    return Path(Path.home(), '.cache', program_name)
@@ -0,0 +1,150 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Series
+
+from ReportPlanner import ReportPlanner, SELECTION_COLUMNS
+
+GROUP_COLUMNS = ['RO_CLUSTER', 'RO'] + SELECTION_COLUMNS + ['PO_SELF']
+
+
+class DateCube:
+    """
+    Накопительные счетчики событий по датам в разрезе групп строк (кластер, регион, колонки отбора листов, работы своими силами).
+    Счетчики каждого потока хранятся отсортированными по (группа, дата) вместе с накопительной суммой,
+    поэтому количество за любое окно - разность двух накопительных сумм, найденных через np.searchsorted.
+    Строится один раз на загруженные данные, после чего сводные таблицы за любой период не требуют прохода по строкам.
+    Ось дат хранит только встречающиеся в данных значения, а группы - только встречающиеся сочетания,
+    поэтому объем памяти пропорционален количеству различных (группа, дата), а не количеству дней.
+    """
+
+    def __init__(self, groups: DataFrame, counts: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]], df: DataFrame = None):
+        """
+        :param groups: сочетания GROUP_COLUMNS, позиция строки - номер группы
+        :param counts: счетчики потоков {имя потока: (номера групп, даты, количество)}
+        :param df: данные, по которым построены счетчики (для переиспользования в WeeklyReport.get_cube)
+        """
+
+        self.df = df
+        self.groups = groups
+        self.planner = ReportPlanner(self.groups)
+
+        self.streams: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        for name, (group_codes, dates, values) in counts.items():
+            timestamps = np.unique(dates)
+            # Ключ счетчика: номер группы и номер даты на общей оси дат потока
+            event_keys = group_codes.astype(np.int64) * (len(timestamps) + 1) + np.searchsorted(timestamps, dates)
+            event_keys, inverse = np.unique(event_keys, return_inverse=True)
+            cumulative = np.concatenate([[0], np.cumsum(np.bincount(inverse, weights=values, minlength=len(event_keys)).astype(np.int64))])
+            self.streams[name] = (timestamps, event_keys, cumulative)
+
+    @classmethod
+    def from_frame(cls, df: DataFrame, streams: dict[str, tuple[str, Series]], po_self: Series) -> 'DateCube':
+        """
+        Строит счетчики по загруженным данным
+        :param df: исходные данные
+        :param streams: потоки событий {имя потока: (колонка с датой события, признак строки)}
+        :param po_self: признак работ своими силами
+        :return: счетчики событий
+        """
+
+        builder = DateCubeBuilder()
+        builder.add(df, streams, po_self)
+        cube = builder.build()
+        cube.df = df
+        return cube
+
+    @property
+    def nbytes(self) -> int:
+        """ Объем памяти счетчиков, групп и выборок групп """
+        return (sum(sum(array.nbytes for array in stream) for stream in self.streams.values())
+                + int(self.groups.memory_usage(deep=True).sum()) + self.planner.nbytes)
+
+    def count(self, stream: str, _begin_date: datetime, _end_date: datetime, groups: np.ndarray = None) -> np.ndarray:
+        """
+        Количество событий потока с датой в периоде, включая границы, по каждой группе
+        :param stream: имя потока
+        :param _begin_date: дата начала периода
+        :param _end_date: дата окончания периода
+        :param groups: позиции групп в self.groups. None - все группы
+        :return: массив количеств в порядке groups
+        """
+
+        timestamps, event_keys, cumulative = self.streams[stream]
+        if groups is None:
+            groups = np.arange(len(self.groups))
+        first = np.searchsorted(timestamps, pd.Timestamp(_begin_date).to_datetime64(), side='left')
+        last = np.searchsorted(timestamps, pd.Timestamp(_end_date).to_datetime64(), side='right')
+        if first >= last:
+            return np.zeros(len(groups), dtype=np.int64)
+        base = np.asarray(groups, dtype=np.int64) * (len(timestamps) + 1)
+        return cumulative[np.searchsorted(event_keys, base + last)] - cumulative[np.searchsorted(event_keys, base + first)]
+
+
+class DateCubeBuilder:
+    """
+    Накапливает счетчики DateCube по частям данных: каждая часть сразу сворачивается в количество событий
+    по (поток, группа, дата), строки части после этого не нужны.
+    Части можно и вычитать, поэтому счетчики новой загрузки получаются из счетчиков предыдущей по измененным строкам.
+    """
+
+    # Количество свернутых частей, после которого они объединяются в одну
+    MAX_PARTS = 32
+
+    def __init__(self, counts: DataFrame = None):
+        """
+        :param counts: начальные счетчики, полученные из counts()
+        """
+
+        self.parts: list[DataFrame] = [] if counts is None else [counts]
+        # Имена всех добавленных потоков: поток без событий тоже должен быть в счетчиках
+        self.stream_names: list[str] = [] if counts is None else list(counts['STREAM'].unique())
+
+    def add(self, df: DataFrame, streams: dict[str, tuple[str, Series]], po_self: Series, sign: int = 1) -> None:
+        """
+        Добавляет часть данных
+        :param df: часть исходных данных
+        :param streams: потоки событий части {имя потока: (колонка с датой события, признак строки)}
+        :param po_self: признак работ своими силами
+        :param sign: 1 - добавить события части, -1 - вычесть
+        """
+
+        # Строки без региона не попадают ни в одну сводную таблицу
+        valid = (df['RO_CLUSTER'].notna() & df['RO'].notna()).to_numpy(dtype=bool)
+        # Категории разных частей не совпадают, поэтому ключи групп хранятся значениями
+        keys = df.loc[valid, GROUP_COLUMNS[:-1]].astype(object).assign(PO_SELF=po_self.to_numpy(dtype=bool)[valid])
+        for name, (date_column, mask_stream) in streams.items():
+            if name not in self.stream_names:
+                self.stream_names.append(name)
+            dates = df[date_column].to_numpy(dtype='datetime64[ns]')[valid]
+            use = mask_stream.to_numpy(dtype=bool)[valid] & ~np.isnat(dates)
+            events = keys[use].assign(STREAM=name, DATE=dates[use])
+            self.parts.append((events.groupby(list(events.columns), sort=False, dropna=False).size() * sign).rename('COUNT').reset_index())
+        if len(self.parts) > self.MAX_PARTS:
+            self.parts = [self._combine()]
+
+    def _combine(self) -> DataFrame:
+        counts = pd.concat(self.parts, ignore_index=True)
+        counts = counts.groupby(GROUP_COLUMNS + ['STREAM', 'DATE'], sort=False, dropna=False)['COUNT'].sum().reset_index()
+        # Вычтенные полностью события не хранятся
+        return counts[counts['COUNT'] != 0].reset_index(drop=True)
+
+    def counts(self) -> DataFrame:
+        """ Количество событий по (группа, поток, дата) по всем добавленным частям """
+        if not self.parts:
+            return DataFrame(columns=GROUP_COLUMNS + ['STREAM', 'DATE', 'COUNT'])
+        self.parts = [self._combine()]
+        return self.parts[0]
+
+    def build(self) -> DateCube:
+        """ Счетчики по всем добавленным частям """
+        counts = self.counts()
+        grouped = counts.groupby(GROUP_COLUMNS, sort=True, dropna=False)
+        group_codes = grouped.ngroup().to_numpy(dtype=np.int64)
+        groups = grouped.size().index.to_frame(index=False)
+        streams = {}
+        for name in dict.fromkeys([*self.stream_names, *counts['STREAM'].unique()]):
+            use = (counts['STREAM'] == name).to_numpy(dtype=bool)
+            streams[name] = (group_codes[use], counts['DATE'].to_numpy(dtype='datetime64[ns]')[use], counts['COUNT'].to_numpy(dtype=np.int64)[use])
+        return DateCube(groups, streams)
@@ -1,11 +1,14 @@
 import sys
+from functools import cached_property
 
 import loguru
+import numpy as np
 from openpyxl import Workbook
 from openpyxl.utils import get_column_letter
 from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.worksheet.table import Table, TableStyleInfo
 from pandas import DataFrame
+from pandas.api.types import is_datetime64_any_dtype
 
 
 def fill_cell_names():
@@ -51,15 +54,43 @@ def adjust_columns_width(_dataframe):
     return _dataframe
 
 
+def dataframe_columns_width(_dataframe: DataFrame) -> list[int]:
+    """
+    Вычисляет ширину колонок таблицы по данным DataFrame, без обхода ячеек листа.
+    Результат совпадает с adjust_columns_width: максимальная длина str() значения ячейки или заголовка плюс 3
+
+    :return List: ширина для каждой колонки
+    """
+    _widths = []
+    for _name in _dataframe.columns:
+        _column = _dataframe[_name]
+        _missing = _column.isna().to_numpy()
+        if is_datetime64_any_dtype(_column):
+            # В ячейку попадает Timestamp: str() дает 'YYYY-MM-DD HH:MM:SS', дробная часть выводится только если она не нулевая
+            _lengths = np.where(_column.dt.nanosecond != 0, 29, np.where(_column.dt.microsecond != 0, 26, 19))
+            _lengths = np.where(_missing, 3, _lengths)  # str(NaT) == 'NaT'
+        else:
+            _lengths = _column.astype(str).str.len().to_numpy(dtype=float, na_value=0)
+            # Пустые значения: str(None) == 'None', str(nan) == 'nan'
+            _lengths = np.where(_missing, np.where(np.equal(_column.to_numpy(dtype=object), None), 4, 3), _lengths)
+        _max_length = max(len(str(_name)), int(_lengths.max(initial=0)))
+        _widths.append(_max_length + 3)
+    return _widths
+
+
 class FormattedWorkbook(Workbook):
     def __init__(self, logging_level='ERROR', table_style='TableStyleMedium2'):
         super().__init__()
         self.logging_level = logging_level
         self.logger = loguru.logger
         self.table_style = table_style
-        self.excel_cell_names = fill_cell_names()
         self.ws = self.active
 
+    @cached_property
+    def excel_cell_names(self):
+        """ Словарь имен колонок Excel, заполняется только при первом обращении """
+        return fill_cell_names()
+
     def excel_format_table(self, df: DataFrame, save_sheet_name: str, save_table_name: str):
         """ Метод обеспечивает форматирование листа Excel с таблицей."""
         self.logger.remove()
@@ -70,11 +101,12 @@ class FormattedWorkbook(Workbook):
         for row in dataframe_to_rows(df, index=False, header=True):
             self.ws.append(row)
         self.logger.info(f'Форматирует таблицу "{save_table_name}"')
-        self.logger.debug(f'Таблица для форматирования: A1:{self.excel_cell_names[len(df.columns)]}{len(df) + 1}')
-        tab = Table(displayName=f'{save_table_name}',
-                    ref=f'A1:{self.excel_cell_names[len(df.columns)]}{len(df) + 1}')
+        table_ref = f'A1:{get_column_letter(len(df.columns))}{len(df) + 1}'
+        self.logger.debug(f'Таблица для форматирования: {table_ref}')
+        tab = Table(displayName=f'{save_table_name}', ref=table_ref)
         tab.tableStyleInfo = TableStyleInfo(name=self.table_style, showRowStripes=True, showColumnStripes=True)
         self.logger.info(f'Добавляем таблицу "{save_table_name}" на лист "{save_sheet_name}"')
         self.ws.add_table(tab)
         self.logger.info(f'Выравниваем поля по размеру в таблице "{save_table_name}"')
-        self.ws = adjust_columns_width(self.ws)
+        for _number, _width in enumerate(dataframe_columns_width(df), start=1):
+            self.ws.column_dimensions[get_column_letter(_number)].width = _width
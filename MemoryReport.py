@@ -0,0 +1,68 @@
+from pandas import DataFrame
+
+from StageProfiler import peak_rss
+
+
+class MemoryReport:
+    """
+    Объем памяти исходных данных и производных таблиц отчета.
+    Выключенный отчет ничего не замеряет: memory_usage(deep=True) для строковых колонок выполняется долго.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.items: list[tuple[str, str, int]] = []
+
+    def add(self, group: str, name: str, nbytes: int) -> None:
+        """
+        Добавляет объект в отчет
+        :param group: группа объектов (исходные данные, выборки, листы периода)
+        :param name: имя объекта
+        :param nbytes: объем памяти в байтах
+        """
+
+        if self.enabled:
+            self.items.append((group, name, int(nbytes)))
+
+    def add_frame(self, group: str, name: str, df: DataFrame, by_column: bool = False) -> None:
+        """
+        Добавляет таблицу в отчет целиком или по колонкам
+        :param group: группа объектов
+        :param name: имя таблицы
+        :param df: таблица
+        :param by_column: добавить каждую колонку отдельной строкой
+        """
+
+        if not self.enabled:
+            return
+        usage = df.memory_usage(deep=True, index=True)
+        if by_column:
+            for column_name, nbytes in usage.items():
+                self.add(group, f'{name}.{column_name} ({df[column_name].dtype})' if column_name != 'Index' else f'{name}.index', nbytes)
+        else:
+            self.add(group, f'{name} ({len(df)} x {len(df.columns)})', usage.sum())
+
+    @property
+    def total(self) -> int:
+        return sum(nbytes for _, _, nbytes in self.items)
+
+    def lines(self) -> list[str]:
+        """
+        Отчет для вывода в консоль: итоги групп, объекты групп, общий итог и пиковый объем памяти процесса
+        :return: строки отчета
+        """
+
+        groups: dict[str, list[tuple[str, int]]] = {}
+        for group, name, nbytes in self.items:
+            groups.setdefault(group, []).append((name, nbytes))
+        lines = []
+        # Группы и объекты в порядке убывания объема памяти
+        for group, items in sorted(groups.items(), key=lambda item: sum(nbytes for _, nbytes in item[1]), reverse=True):
+            lines.append(f'{group:<64} {sum(nbytes for _, nbytes in items) / 2 ** 20:10.2f} МБ')
+            for name, nbytes in sorted(items, key=lambda item: item[1], reverse=True):
+                lines.append(f'    {name:<60} {nbytes / 2 ** 20:10.2f} МБ')
+        lines.append(f'{"Всего учтено":<64} {self.total / 2 ** 20:10.2f} МБ')
+        process_peak = peak_rss()
+        if process_peak is not None:
+            lines.append(f'{"Пиковый объем памяти процесса":<64} {process_peak / 2 ** 20:10.2f} МБ')
+        return lines
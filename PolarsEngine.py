@@ -0,0 +1,76 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Series
+
+from ReportPlanner import METRICS, SELECTION_COLUMNS, SheetSpec
+
+
+class PolarsEngine:
+    """
+    Расчет сводных таблиц листов на polars (--engine polars).
+    Строки листов, окна дат и показатели задаются теми же SHEET_SPECS, METRICS и WeeklyReport.make_windows, что и для make_report.
+    Запросы всех листов строятся лениво и выполняются одним pl.collect_all() в несколько потоков,
+    строковые колонки сравниваются в polars без object-колонок pandas и без копий выборок строк.
+    polars - необязательная зависимость, импортируется только при создании объекта.
+    """
+
+    def __init__(self, df: DataFrame, streams: dict[str, tuple[str, Series]], po_self: Series):
+        """
+        :param df: исходные данные
+        :param streams: потоки событий {имя потока: (колонка с датой события, признак строки)}
+        :param po_self: признак работ своими силами
+        """
+
+        import polars as pl
+        self.pl = pl
+        self.df = df
+        # Потоки событий переносятся в polars колонками дат: дата события, если строка относится к потоку, иначе пусто
+        columns = {column_name: df[column_name].astype(object).where(df[column_name].notna(), None).to_numpy()
+                   for column_name in ['RO_CLUSTER', 'RO'] + SELECTION_COLUMNS}
+        frame = pl.DataFrame({
+            **{column_name: pl.Series(column_name, values, dtype=pl.String) for column_name, values in columns.items()},
+            'PO_SELF': po_self.to_numpy(dtype=bool),
+            **{name: df[date_column].where(mask_stream.to_numpy(dtype=bool)).to_numpy()
+               for name, (date_column, mask_stream) in streams.items()},
+        })
+        self.frame = frame.filter(pl.col('RO_CLUSTER').is_not_null() & pl.col('RO').is_not_null())
+
+    def selection(self, spec: SheetSpec):
+        """ Условие отбора строк листа, то же, что ReportPlanner.rows() """
+        pl = self.pl
+        condition = (pl.col('CHECK_PLAN') == 'Да') & pl.col('BP_ESUP').is_in(list(spec.business_processes))
+        if spec.new_bs is not None:
+            condition = condition & ((pl.col('CHECK_NEW_PLAN') == 'Новая').fill_null(False) == spec.new_bs)
+        if spec.program is not None:
+            condition = condition & (pl.col('PROGRAM') == spec.program)
+        return condition.fill_null(False)
+
+    def report_counts(self, sheets: list[tuple[SheetSpec, list[str]]],
+                      windows: dict[str, tuple[datetime.datetime, datetime.datetime]]) -> list[DataFrame]:
+        """
+        Количество по показателям для нескольких листов
+        :param sheets: список (описание листа, показатели в порядке колонок)
+        :param windows: окна дат периода (WeeklyReport.make_windows)
+        :return: таблицы с индексом (RO_CLUSTER, RO) в порядке sheets, как groupby().sum() в make_report
+        """
+
+        pl = self.pl
+        queries = []
+        for spec, metrics in sheets:
+            aggregations = []
+            for name in metrics:
+                metric = METRICS[name]
+                begin_date, end_date = windows[metric.window]
+                condition = pl.col(metric.stream).is_between(begin_date, end_date, closed='both')
+                if metric.po_self is not None:
+                    condition = condition & (pl.col('PO_SELF') == metric.po_self)
+                aggregations.append(condition.fill_null(False).cast(pl.Int64).sum().alias(name))
+            queries.append(self.frame.lazy().filter(self.selection(spec)).group_by(['RO_CLUSTER', 'RO']).agg(aggregations).sort(['RO_CLUSTER', 'RO']))
+        frames = []
+        for (_, metrics), result in zip(sheets, pl.collect_all(queries)):
+            counts = pd.DataFrame({name: result[name].to_numpy().astype(np.int64) for name in metrics},
+                                  index=pd.MultiIndex.from_arrays([result['RO_CLUSTER'].to_list(), result['RO'].to_list()], names=['RO_CLUSTER', 'RO']))
+            frames.append(counts)
+        return frames
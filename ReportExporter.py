@@ -0,0 +1,61 @@
+import json
+from pathlib import Path
+from typing import Union
+
+import loguru
+from pandas import DataFrame
+from pandas.api.types import is_float_dtype
+
+
+class ReportExporter:
+    """
+    Выгрузка листов отчета в Parquet, CSV и JSON для внешних систем, без разбора отформатированного .xlsx.
+    Каждый лист сохраняется в файл с именем таблицы листа, состав выгрузки описывается в manifest.json.
+    """
+
+    FORMATS = ('parquet', 'csv', 'json')
+    MANIFEST_FILE = 'manifest.json'
+
+    def __init__(self, formats: list[str]):
+        self.formats = formats
+        self.logger = loguru.logger
+
+    def export(self, export_dir: Union[str, Path], sheets: list[tuple[str, str, DataFrame]], meta: dict) -> list[Path]:
+        """
+        Сохраняет листы отчета во всех выбранных форматах
+        :param export_dir: каталог выгрузки
+        :param sheets: список (имя листа, имя таблицы, данные)
+        :param meta: описание выгрузки (период, версия программы), записывается в manifest.json
+        :return: список созданных файлов
+        """
+
+        export_dir = Path(export_dir)
+        export_dir.mkdir(parents=True, exist_ok=True)
+        files = []
+        datasets = []
+        for sheet_name, table_name, _df in sheets:
+            _df = _df.reset_index(drop=True)
+            # Сводные таблицы становятся float из-за строки ИТОГО:, целые значения выгружаются целыми
+            _df = _df.astype({column_name: 'int64' for column_name in _df.columns
+                              if is_float_dtype(_df[column_name]) and _df[column_name].notna().all() and (_df[column_name] % 1 == 0).all()})
+            dataset = {'sheet': sheet_name, 'name': table_name, 'rows': len(_df), 'columns': [str(column) for column in _df.columns], 'files': {}}
+            for export_format in self.formats:
+                file_name = Path(export_dir, f'{table_name}.{export_format}')
+                self.logger.info(f'Сохраняем лист "{sheet_name}" в файл "{file_name}"')
+                if export_format == 'parquet':
+                    _df.to_parquet(file_name, index=False)
+                elif export_format == 'csv':
+                    # Разделитель и кодировка, которые Excel с русской локалью открывает без настройки
+                    _df.to_csv(file_name, index=False, sep=';', encoding='utf-8-sig')
+                elif export_format == 'json':
+                    _df.to_json(file_name, orient='records', date_format='iso', force_ascii=False, indent=2)
+                else:
+                    raise ValueError(f'Неизвестный формат выгрузки: {export_format}')
+                dataset['files'][export_format] = file_name.name
+                files.append(file_name)
+            datasets.append(dataset)
+        manifest = Path(export_dir, self.MANIFEST_FILE)
+        with open(manifest, 'w', encoding='utf-8') as f:
+            json.dump({**meta, 'datasets': datasets}, f, ensure_ascii=False, indent=2, default=str)
+        files.append(manifest)
+        return files
@@ -0,0 +1,111 @@
+import calendar
+import datetime
+from typing import NamedTuple
+
+
+def parse_date(date_string: str) -> datetime.date:
+    """
+    Разбирает дату в формате YYYY-MM-DD
+    :param date_string: строка с датой
+    :return: дата
+    """
+
+    split_date: list[int] = list(map(int, date_string.split('-')))
+    return datetime.date(year=split_date[0], month=split_date[1], day=split_date[2])
+
+
+class ReportPeriod(NamedTuple):
+    """
+    Период анализа отчета
+    """
+
+    begin_date: datetime.datetime
+    end_date: datetime.datetime
+
+    @classmethod
+    def from_dates(cls, begin_date: datetime.date, end_date: datetime.date) -> 'ReportPeriod':
+        """
+        Формирует период с начала дня begin_date до конца дня end_date
+        :param begin_date: дата начала периода
+        :param end_date: дата окончания периода
+        :return: период анализа
+        """
+
+        period = cls(datetime.datetime(year=begin_date.year, month=begin_date.month, day=begin_date.day, hour=0, minute=0, second=0),
+                     datetime.datetime(year=end_date.year, month=end_date.month, day=end_date.day, hour=23, minute=59, second=59, microsecond=99999))
+        if period.begin_date > period.end_date:
+            raise ValueError(f'дата начала периода {begin_date:%Y-%m-%d} позже даты окончания {end_date:%Y-%m-%d}')
+        return period
+
+    @classmethod
+    def parse(cls, period_string: str) -> 'ReportPeriod':
+        """
+        Разбирает период в формате YYYY-MM-DD:YYYY-MM-DD
+        :param period_string: строка с периодом
+        :return: период анализа
+        """
+
+        dates = period_string.split(':')
+        if len(dates) != 2:
+            raise ValueError(f'период "{period_string}" должен иметь формат YYYY-MM-DD:YYYY-MM-DD')
+        try:
+            begin_date, end_date = map(parse_date, dates)
+        except (ValueError, IndexError):
+            raise ValueError(f'в периоде "{period_string}" неверная дата, формат даты YYYY-MM-DD') from None
+        return cls.from_dates(begin_date, end_date)
+
+    @classmethod
+    def current_month(cls, today: datetime.date) -> 'ReportPeriod':
+        """
+        Период по умолчанию: текущий месяц целиком
+        :param today: текущая дата
+        :return: период анализа
+        """
+
+        return cls.from_dates(datetime.date(today.year, today.month, 1),
+                              datetime.date(today.year, today.month, calendar.monthrange(today.year, today.month)[1]))
+
+    @property
+    def begin_of_the_year(self) -> datetime.datetime:
+        return datetime.datetime(year=self.begin_date.year, month=1, day=1)
+
+    @property
+    def end_of_the_year(self) -> datetime.datetime:
+        return datetime.datetime(year=self.end_date.year, month=12, day=31, hour=23, minute=59, second=59, microsecond=99999)
+
+    @property
+    def process_year(self) -> list[int]:
+        if self.begin_date.year == self.end_date.year:
+            return [self.begin_date.year]
+        return [self.begin_date.year, self.end_date.year]
+
+    @property
+    def name(self) -> str:
+        """ Имя периода для имени файла отчета """
+        return f'{self.begin_date.strftime("%Y-%m-%d")} - {self.end_date.strftime("%Y-%m-%d")}'
+
+    def split(self, rule: str) -> list['ReportPeriod']:
+        """
+        Разбивает период на ISO недели (с понедельника по воскресенье), календарные месяцы или кварталы.
+        Крайние части обрезаются по границам периода
+        :param rule: 'week', 'month' или 'quarter'
+        :return: список периодов
+        """
+
+        periods = []
+        begin_date = self.begin_date.date()
+        last_date = self.end_date.date()
+        while begin_date <= last_date:
+            if rule == 'week':
+                end_date = begin_date + datetime.timedelta(days=6 - begin_date.weekday())
+            elif rule == 'month':
+                end_date = datetime.date(begin_date.year, begin_date.month, calendar.monthrange(begin_date.year, begin_date.month)[1])
+            elif rule == 'quarter':
+                end_month = (begin_date.month - 1) // 3 * 3 + 3
+                end_date = datetime.date(begin_date.year, end_month, calendar.monthrange(begin_date.year, end_month)[1])
+            else:
+                raise ValueError(f'Неизвестное правило разбиения периода: {rule}')
+            end_date = min(end_date, last_date)
+            periods.append(ReportPeriod.from_dates(begin_date, end_date))
+            begin_date = end_date + datetime.timedelta(days=1)
+        return periods
@@ -0,0 +1,197 @@
+import datetime
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from pandas.api.types import is_datetime64_any_dtype
+
+
+class MetricSpec(NamedTuple):
+    """
+    Описание показателя сводного отчета: количество событий потока, попавших в окно периода
+    """
+
+    stream: str  # поток событий: колонка с датой и признак строки (WeeklyReport.make_event_streams)
+    window: str  # окно периода: 'ytd' - с начала года, 'period' - период анализа, 'forward' - после периода до конца года
+    po_self: Optional[bool] = None  # True - только работы своими силами, False - только работы ПО, None - все
+
+
+class SheetSpec(NamedTuple):
+    """
+    Описание листа сводного отчета
+    """
+
+    name: str  # имя листа отчета
+    business_processes: tuple[str, ...]  # значения BP_ESUP, попадающие в лист
+    new_bs: Optional[bool] = None  # True - только новые, False - только существующие, None - все
+    program: Optional[str] = None  # фильтр по программе (PROGRAM)
+    divide_prognosis: bool = False  # разделить прогноз на работы ПО и работы своими силами
+    add_spec: bool = False  # добавить комплекты 48-х и НП
+    experimental: bool = False  # лист формируется только с ключом --experimental
+    ap_sheet: Optional[str] = None  # имя листа с адресным планом по данным листа
+
+
+BS_PROCESSES = ('Строительство БС/АМС', 'Переоборудование БС', 'БС_Включение RAN Sharing')
+RRL_PROCESSES = ('Строительство РРЛ', 'Переоборудование РРЛ')
+ENERGY_PROCESSES = ('Модернизация энергоснабжения',)
+CLIMATE_PROCESSES = ('Модернизация климатического оборудования',)
+IPBH_PROCESSES = ('Ввод/модернизация/демонтаж элемента ТС - IPBH',)
+VOLS_PROCESSES = ('Строительство ВОЛС (городская)',)
+
+METRICS = {
+    'PLAN_DATE_END': MetricSpec('plan', 'ytd'),
+    'CUMM_PROGNOZ_DATE': MetricSpec('prognoz', 'ytd'),
+    'PROGNOZ_DATE': MetricSpec('prognoz', 'period'),
+    'PROGNOZ_DATE_PO': MetricSpec('prognoz', 'period', po_self=False),
+    'PROGNOZ_DATE_SELF': MetricSpec('prognoz', 'period', po_self=True),
+    'CHECK_FACT': MetricSpec('fact', 'ytd'),
+    # Выдача, комплекты 48-х и НП считаются по тому же окну PROGNOZ_DATE, что и накопительный прогноз
+    'Выдача оборудования': MetricSpec('vidacha', 'ytd'),
+    'FORWARD_VIDACHA': MetricSpec('vidacha', 'forward'),
+    'Комплект 48-х': MetricSpec('spec48', 'ytd'),
+    'НП': MetricSpec('np', 'ytd'),
+}
+
+# Колонки, по которым ReportPlanner.rows() отбирает строки листов
+SELECTION_COLUMNS = ['CHECK_PLAN', 'BP_ESUP', 'CHECK_NEW_PLAN', 'PROGRAM']
+
+# Убрал, в связи с изменение методики KPI в 2024 году: 'Pico Cell_Включение', 'Демонтаж БС/АМС'
+SHEET_SPECS = (
+    SheetSpec('Всего БС', BS_PROCESSES, ap_sheet='АП БС'),
+    SheetSpec('Новые БС', BS_PROCESSES, new_bs=True),
+    SheetSpec('Существующие БС', BS_PROCESSES, new_bs=False),
+    SheetSpec('РРЛ', RRL_PROCESSES, ap_sheet='АП РРЛ'),
+    SheetSpec('Энерго', ENERGY_PROCESSES, ap_sheet='АП Энерго'),
+    SheetSpec('Климатика', CLIMATE_PROCESSES, ap_sheet='АП Климатика'),
+    SheetSpec('IPBH', IPBH_PROCESSES, experimental=True, ap_sheet='АП IPBH'),
+    SheetSpec('ВОЛС', VOLS_PROCESSES, experimental=True, ap_sheet='АП ВОЛС'),
+    SheetSpec('АКБ', ENERGY_PROCESSES, program='КФ. Base Case Эксплуатации – АКБ Волна 1. 2025', add_spec=True, experimental=True),
+)
+
+
+class ReportPlanner:
+    """
+    Формирует выборки строк для листов отчета.
+    Каждое условие отбора вычисляется один раз на полном наборе данных и переиспользуется всеми листами,
+    а выборки возвращаются в виде позиций строк, без копирования данных.
+    Для отбора строк листа по окну дат строится индекс: строки листа, упорядоченные по региону и дате,
+    поэтому окно любого периода выбирается через np.searchsorted без сравнения всей колонки и без сортировки результата.
+    """
+
+    def __init__(self, df: DataFrame):
+        self.df = df
+        self._masks: dict[tuple, np.ndarray] = {}
+        self._rows: dict[SheetSpec, np.ndarray] = {}
+        self._region_codes: np.ndarray = None
+        self._date_indexes: dict[tuple, tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+
+    @property
+    def nbytes(self) -> int:
+        """ Объем памяти вычисленных масок, выборок строк и индексов дат """
+        return (sum(_mask.nbytes for _mask in self._masks.values()) + sum(rows.nbytes for rows in self._rows.values())
+                + (0 if self._region_codes is None else self._region_codes.nbytes)
+                + sum(sum(array.nbytes for array in index) for index in self._date_indexes.values()))
+
+    def mask(self, column_name: str, values: tuple) -> np.ndarray:
+        """
+        Маска строк, у которых значение колонки входит в список значений
+        :param column_name: имя колонки
+        :param values: допустимые значения
+        :return: логическая маска по всем строкам данных
+        """
+
+        key = ('isin', column_name, frozenset(values))
+        if key not in self._masks:
+            self._masks[key] = self.df[column_name].isin(values).to_numpy(dtype=bool)
+        return self._masks[key]
+
+    def date_mask(self, column_name: str, _begin_date: datetime, _end_date: datetime) -> np.ndarray:
+        """
+        Маска строк, у которых дата в колонке попадает в период, включая границы
+        :param column_name: имя колонки с датой
+        :param _begin_date: дата начала периода
+        :param _end_date: дата окончания периода
+        :return: логическая маска по всем строкам данных
+        """
+
+        key = ('date', column_name, _begin_date, _end_date)
+        if key not in self._masks:
+            self._masks[key] = ((self.df[column_name] >= _begin_date) & (self.df[column_name] <= _end_date)).to_numpy(dtype=bool)
+        return self._masks[key]
+
+    def rows(self, spec: SheetSpec) -> np.ndarray:
+        """
+        Позиции строк, попадающих в лист отчета
+        :param spec: описание листа
+        :return: отсортированный массив позиций строк
+        """
+
+        if spec not in self._rows:
+            _mask = self.mask('CHECK_PLAN', ('Да',)) & self.mask('BP_ESUP', spec.business_processes)
+            if spec.new_bs is not None:
+                mask_new_bs = self.mask('CHECK_NEW_PLAN', ('Новая',))
+                _mask = _mask & (mask_new_bs if spec.new_bs else ~mask_new_bs)
+            if spec.program is not None:
+                _mask = _mask & self.mask('PROGRAM', (spec.program,))
+            self._rows[spec] = np.flatnonzero(_mask)
+        return self._rows[spec]
+
+    def region_codes(self) -> np.ndarray:
+        """
+        Номер региона (RO) каждой строки в порядке сортировки регионов, как в sort_values(by='RO'). Пустой регион - последний
+        """
+
+        if self._region_codes is None:
+            column = self.df['RO']
+            codes = column.cat.codes.to_numpy() if isinstance(column.dtype, pd.CategoricalDtype) else pd.factorize(column, sort=True)[0]
+            self._region_codes = np.where(codes < 0, codes.max(initial=0) + 1, codes).astype(np.int32)
+        return self._region_codes
+
+    def date_index(self, spec: SheetSpec, column_name: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Индекс строк листа по дате: строки упорядочены по региону, внутри региона - по дате (пустые даты в конце)
+        :param spec: описание листа
+        :param column_name: имя колонки с датой
+        :return: границы регионов, даты и позиции строк в порядке индекса
+        """
+
+        key = (spec, column_name)
+        if key not in self._date_indexes:
+            rows = self.rows(spec)
+            codes = self.region_codes()[rows]
+            dates = self.df[column_name].to_numpy()[rows]
+            order = np.lexsort((dates, codes))
+            codes = codes[order]
+            boundaries = np.concatenate([[0], np.flatnonzero(codes[1:] != codes[:-1]) + 1, [len(codes)]])
+            self._date_indexes[key] = (boundaries, dates[order], rows[order])
+        return self._date_indexes[key]
+
+    def window_rows(self, spec: SheetSpec, column_name: str, _begin_date: datetime, _end_date: datetime) -> np.ndarray:
+        """
+        Позиции строк листа, у которых дата в колонке попадает в период, включая границы.
+        Строки упорядочены по региону, внутри региона - по позиции строки, как после sort_values(by='RO', kind='stable')
+        :param spec: описание листа
+        :param column_name: имя колонки с датой
+        :param _begin_date: дата начала периода
+        :param _end_date: дата окончания периода
+        :return: массив позиций строк
+        """
+
+        if not is_datetime64_any_dtype(self.df[column_name]):
+            # Колонка не приведена к датам: отбор сравнением всей колонки и сортировка по региону
+            rows = self.rows(spec)
+            rows = rows[self.date_mask(column_name, _begin_date, _end_date)[rows]]
+            return rows[np.argsort(self.region_codes()[rows], kind='stable')]
+
+        boundaries, dates, positions = self.date_index(spec, column_name)
+        begin_date = pd.Timestamp(_begin_date).to_datetime64()
+        end_date = pd.Timestamp(_end_date).to_datetime64()
+        parts = []
+        for first, last in zip(boundaries[:-1], boundaries[1:]):
+            region_dates = dates[first:last]
+            begin = first + np.searchsorted(region_dates, begin_date, side='left')
+            end = first + np.searchsorted(region_dates, end_date, side='right')
+            # Внутри региона строки выводятся в исходном порядке, сортируется только окно
+            parts.append(np.sort(positions[begin:end]))
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
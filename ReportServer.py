@@ -0,0 +1,143 @@
+import datetime
+import json
+import os
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+import loguru
+
+from ReportPeriod import ReportPeriod, parse_date
+from ReportPlanner import SHEET_SPECS
+
+
+class ReportServer:
+    """
+    Локальный HTTP/JSON сервис разовых выборок из загруженных данных.
+    Данные 'Массив' загружаются один раз и перечитываются только после изменения файлов с данными,
+    ответы хранятся в LRU кэше по параметрам запроса и сбрасываются вместе с данными.
+
+    GET /sheets - листы, по которым доступны выборки
+    GET /report?sheet=Энерго&begin=YYYY-MM-DD&end=YYYY-MM-DD&cluster=Cluster C - сводная таблица листа
+    GET /ap?sheet=Энерго&begin=YYYY-MM-DD&end=YYYY-MM-DD&cluster=Cluster C - адресный план листа
+    Период по умолчанию - период из параметров запуска (без -b/-e - текущий месяц на дату запроса),
+    без cluster выборка по всем кластерам.
+    """
+
+    def __init__(self, wr, cache_size: int = 256):
+        """
+        :param wr: WeeklyReport с параметрами запуска
+        :param cache_size: количество ответов в LRU кэше
+        """
+
+        self.wr = wr
+        self.logger = loguru.logger
+        self.specs = {spec.name: spec for spec in SHEET_SPECS}
+        self.data = None
+        self.mtime = None
+        self._lock = threading.Lock()
+        self._query = lru_cache(maxsize=cache_size)(self._make_response)
+
+    def refresh(self) -> None:
+        """ Перечитывает данные и сбрасывает кэш ответов, если файлы с данными изменились """
+        with self._lock:
+            if self.wr.default_period:
+                # Сервис может работать дольше месяца запуска: период по умолчанию определяется заново, как в режиме --watch
+                self.wr.set_period(datetime.date.today())
+            mtime = tuple(os.stat(url).st_mtime_ns for url in self.wr.urls)
+            if mtime == self.mtime:
+                return
+            data = self.wr.get_data(check_age=False)
+            if data is not self.data:
+                self.data = data
+                self._query.cache_clear()
+                self.logger.info('Данные перечитаны, кэш ответов сброшен')
+            self.mtime = mtime
+
+    def query(self, endpoint: str, params: dict[str, str]) -> Optional[bytes]:
+        """
+        Ответ на запрос в формате JSON
+        :param endpoint: 'sheets', 'report' или 'ap'
+        :param params: параметры запроса
+        :return: тело ответа или None для неизвестного запроса
+        """
+
+        if endpoint == 'sheets':
+            return self._dumps([{'sheet': spec.name, 'ap': spec.ap_sheet is not None, 'experimental': spec.experimental} for spec in SHEET_SPECS])
+        if endpoint not in ('report', 'ap'):
+            return None
+        self.refresh()
+        # В кэше ответов хранится уже определенный период, а не параметры begin и end
+        begin, end = params.get('begin'), params.get('end')
+        period = ReportPeriod.from_dates(self.wr.period.begin_date if begin is None else parse_date(begin),
+                                         self.wr.period.end_date if end is None else parse_date(end))
+        return self._query(endpoint, params.get('sheet'), period, params.get('cluster'))
+
+    def _make_response(self, endpoint: str, sheet: str, period: ReportPeriod, cluster: str) -> bytes:
+        if sheet not in self.specs:
+            raise ValueError(f'Неизвестный лист: {sheet}. Доступные листы: {", ".join(self.specs)}')
+        spec = self.specs[sheet]
+        clusters = list(self.wr.ro_cluster['RO_CLUSTER'].unique())
+        if cluster is not None and cluster not in clusters:
+            raise ValueError(f'Неизвестный кластер: {cluster}. Доступные кластеры: {", ".join(clusters)}')
+        df_kpi = self.data[self.wr.sheets[0]]
+        if endpoint == 'report':
+            frame = self.wr.make_cube_report(self.wr.get_cube(df_kpi), spec, period, cluster)
+        elif spec.ap_sheet is None:
+            raise ValueError(f'Для листа {sheet} адресный план не формируется')
+        else:
+            frame = self.wr.make_ap(df_kpi, self.wr.ap_rows(df_kpi, spec, period, cluster))
+        return self._dumps({
+            'sheet': sheet,
+            'period': period.name,
+            'cluster': cluster,
+            'columns': [str(column) for column in frame.columns],
+            'rows': json.loads(frame.to_json(orient='values', date_format='iso', force_ascii=False)),
+        })
+
+    @staticmethod
+    def _dumps(body) -> bytes:
+        return json.dumps(body, ensure_ascii=False).encode('utf-8')
+
+    def serve(self, host: str = '127.0.0.1', port: int = 8080) -> None:
+        """
+        Загружает данные и обрабатывает запросы до остановки (Ctrl+C)
+        :param host: адрес сервиса
+        :param port: порт сервиса
+        """
+
+        self.refresh()
+        httpd = ThreadingHTTPServer((host, port), ReportRequestHandler)
+        httpd.report_server = self
+        print(f'Сервис выборок запущен: http://{host}:{httpd.server_port}/sheets')
+        try:
+            httpd.serve_forever()
+        finally:
+            httpd.server_close()
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """ Обработчик запросов ReportServer """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            body, status = self.server.report_server.query(url.path.strip('/'), params), 200
+            if body is None:
+                body, status = ReportServer._dumps({'error': f'Неизвестный запрос: {url.path}'}), 404
+        except (ValueError, IndexError) as ex:
+            body, status = ReportServer._dumps({'error': f'Неверные параметры запроса: {ex}'}), 400
+        except Exception as ex:
+            loguru.logger.exception(f'Ошибка обработки запроса {self.path}')
+            body, status = ReportServer._dumps({'error': str(ex)}), 500
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        loguru.logger.debug(f'{self.address_string()} {format % args}')
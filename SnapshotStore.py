@@ -0,0 +1,95 @@
+import datetime
+import os
+import sqlite3
+import sys
+from contextlib import closing
+from pathlib import Path
+from typing import Union
+
+import loguru
+import pandas as pd
+from pandas import DataFrame
+
+
+class SnapshotStore:
+    """
+    Локальное хранилище сводных таблиц прошлых запусков в SQLite.
+    Строка хранилища - значение показателя региона на листе отчета за период по одной выгрузке данных ('mdp_upload_date').
+    Повторный запуск по той же выгрузке и периоду заменяет сохраненные значения, старые файлы с данными повторно не обрабатываются.
+    """
+
+    TABLE = 'snapshots'
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.logger = loguru.logger
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path)
+        connection.execute(f'CREATE TABLE IF NOT EXISTS {self.TABLE} ('
+                           'upload_date TEXT NOT NULL, begin_date TEXT NOT NULL, end_date TEXT NOT NULL, '
+                           'sheet TEXT NOT NULL, region TEXT NOT NULL, metric TEXT NOT NULL, value REAL, created TEXT NOT NULL, '
+                           'PRIMARY KEY (upload_date, begin_date, end_date, sheet, region, metric))')
+        return connection
+
+    @staticmethod
+    def _date(value: datetime.datetime) -> str:
+        return pd.Timestamp(value).isoformat(sep=' ', timespec='seconds')
+
+    def save(self, upload_date: datetime.datetime, begin_date: datetime.datetime, end_date: datetime.datetime,
+             sheets: list[tuple[str, DataFrame]]) -> int:
+        """
+        Сохраняет сводные таблицы запуска. Сохраненные ранее таблицы тех же листов за ту же выгрузку и период заменяются
+        :param upload_date: дата выгрузки данных
+        :param begin_date: дата начала периода анализа
+        :param end_date: дата окончания периода анализа
+        :param sheets: список (имя листа, сводная таблица с колонкой 'Регион')
+        :return: количество сохраненных значений
+        """
+
+        key = (self._date(upload_date), self._date(begin_date), self._date(end_date))
+        created = datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
+        rows = []
+        for sheet_name, _df in sheets:
+            values = _df.melt(id_vars='Регион', var_name='metric', value_name='value').dropna(subset=['Регион'])
+            rows += [(*key, sheet_name, str(region), str(metric), None if pd.isna(value) else float(value), created)
+                     for region, metric, value in values.itertuples(index=False)]
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(f'DELETE FROM {self.TABLE} WHERE upload_date = ? AND begin_date = ? AND end_date = ? AND sheet = ?',
+                                   [(*key, sheet_name) for sheet_name, _ in sheets])
+            connection.executemany(f'INSERT INTO {self.TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.logger.info(f'В хранилище "{self.path}" сохранено {len(rows)} значений')
+        return len(rows)
+
+    def load(self, begin_date: datetime.datetime, end_date: datetime.datetime, region: str = None) -> DataFrame:
+        """
+        Загружает сохраненные значения за период
+        :param begin_date: дата начала периода анализа
+        :param end_date: дата окончания периода анализа
+        :param region: только значения региона (или строки 'ИТОГО:'). None - все регионы
+        :return: таблица с колонками upload_date, sheet, region, metric, value
+        """
+
+        query = f'SELECT upload_date, sheet, region, metric, value FROM {self.TABLE} WHERE begin_date = ? AND end_date = ?'
+        params = [self._date(begin_date), self._date(end_date)]
+        if region is not None:
+            query += ' AND region = ?'
+            params.append(region)
+        with closing(self._connect()) as connection:
+            _df = pd.read_sql_query(query + ' ORDER BY upload_date', connection, params=params)
+        _df['upload_date'] = pd.to_datetime(_df['upload_date'])
+        return _df
+
+
+def default_history_file(program_name: str) -> Path:
+    """
+    Файл хранилища истории по умолчанию: %LOCALAPPDATA% в Windows, ~/.local/share в остальных системах.
+    Хранилище не находится в каталоге кэша, поэтому не удаляется ключом --clear-cache
+    :param program_name: имя программы, используется как имя подкаталога
+    :return: путь к файлу хранилища
+    """
+
+    if sys.platform == 'win32':
+        return Path(os.environ.get('LOCALAPPDATA', Path(Path.home(), 'AppData', 'Local')), program_name, 'history.sqlite')
+    return Path(Path.home(), '.local', 'share', program_name, 'history.sqlite')
@@ -0,0 +1,86 @@
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import Union
+
+import loguru
+
+from Colors import Colors
+
+
+class SourceMirror:
+    """
+    Локальная копия файлов с данными с сетевого диска.
+    Файл копируется, только если его размер или время изменения отличаются от копии. Копирование идет большими блоками
+    во временный файл .part, после сетевой ошибки продолжается с места остановки, копия заменяется только целиком.
+    Копия получает время изменения исходного файла, поэтому проверка актуальности не требует чтения файла.
+    """
+
+    CHUNK_SIZE = 16 * 2 ** 20
+
+    def __init__(self, mirror_dir: Union[str, Path], retries: int = 5, retry_delay: float = 5.0):
+        self.mirror_dir = Path(mirror_dir)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.logger = loguru.logger
+
+    @staticmethod
+    def is_network_path(url: Union[str, Path]) -> bool:
+        """ Файл на сетевом диске (UNC путь) """
+        return str(url).startswith(('//', '\\\\'))
+
+    def local_path(self, url: Union[str, Path]) -> Path:
+        """ Путь локальной копии: имя файла сохраняется, каталог определяется полным путем исходного файла """
+        return Path(self.mirror_dir, hashlib.sha1(str(Path(url).absolute()).encode('utf-8')).hexdigest()[:16], Path(url).name)
+
+    def sync(self, url: Union[str, Path]) -> Path:
+        """
+        Обновляет локальную копию файла, если исходный файл изменился
+        :param url: исходный файл
+        :return: путь локальной копии
+        """
+
+        local = self.local_path(url)
+        for attempt in range(1, self.retries + 1):
+            try:
+                stat = os.stat(url)
+                if local.is_file() and local.stat().st_size == stat.st_size and local.stat().st_mtime_ns == stat.st_mtime_ns:
+                    self.logger.info(f'Локальная копия "{local}" актуальна')
+                    return local
+                self._copy(url, local, stat)
+                return local
+            except FileNotFoundError:
+                raise
+            except OSError as ex:
+                if attempt == self.retries:
+                    raise
+                print(f'{Colors.YELLOW}Ошибка копирования файла "{url}": {ex}. Повтор через {self.retry_delay:.0f} с ({attempt}/{self.retries}){Colors.END}')
+                time.sleep(self.retry_delay)
+        return local
+
+    def _copy(self, url: Union[str, Path], local: Path, stat: os.stat_result) -> None:
+        local.parent.mkdir(parents=True, exist_ok=True)
+        # Имя временного файла содержит версию исходного файла: докачивается только та же версия
+        part = Path(local.parent, f'{local.name}.{stat.st_size}_{stat.st_mtime_ns}.part')
+        for old_part in local.parent.glob(f'{local.name}.*.part'):
+            if old_part != part:
+                old_part.unlink(missing_ok=True)
+        offset = part.stat().st_size if part.is_file() else 0
+        print(f'Копируем файл {Colors.GREEN}"{url}"{Colors.END} в {Colors.GREEN}"{local}"{Colors.END}' + (f' с {offset / 2 ** 20:.1f} МБ' if offset else ''))
+        with open(url, 'rb') as src, open(part, 'ab') as dst:
+            src.seek(offset)
+            while True:
+                chunk = src.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                dst.write(chunk)
+                offset += len(chunk)
+                print(f'\r    {offset / 2 ** 20:8.1f} из {stat.st_size / 2 ** 20:.1f} МБ ({offset / max(stat.st_size, 1):.0%})', end='', flush=True)
+        print()
+        current = os.stat(url)
+        if (current.st_size, current.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns) or offset != stat.st_size:
+            part.unlink(missing_ok=True)
+            raise OSError('Файл изменился во время копирования')
+        os.utime(part, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(part, local)
@@ -0,0 +1,80 @@
+import datetime
+from pathlib import Path
+from typing import Callable, Iterator, Union
+
+from pandas import DataFrame
+
+
+class SourceStream:
+    """
+    Потоковое чтение листа файла с данными частями по batch_size строк.
+    В памяти одновременно находится только одна часть листа и только колонки, которые нужны для отчета.
+    Значения ячеек приводятся так же, как при чтении листа целиком через pd.ExcelFile(engine="calamine").
+    """
+
+    BATCH_SIZE = 100_000
+
+    def __init__(self, use_column: Callable[[str], bool], batch_size: int = BATCH_SIZE):
+        """
+        :param use_column: проверка, нужна ли колонка листа (WeeklyReport.use_source_column)
+        :param batch_size: количество строк в части
+        """
+
+        self.use_column = use_column
+        self.batch_size = batch_size
+
+    @staticmethod
+    def convert_cell(value):
+        """ Пустая ячейка - None, целые числа - int, даты - datetime """
+        if value == '':
+            return None
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+            return datetime.datetime.combine(value, datetime.time())
+        return value
+
+    def iter_calamine(self, path: Union[str, Path], sheet_name: str) -> Iterator[DataFrame]:
+        """
+        Читает лист файла через calamine
+        :param path: файл с данными
+        :param sheet_name: имя листа
+        :return: части листа. Для пустого листа - одна пустая часть с колонками листа
+        """
+
+        # calamine импортируется только при чтении, как и остальные библиотеки работы с Excel
+        from python_calamine import CalamineWorkbook
+        rows = CalamineWorkbook.from_path(str(path)).get_sheet_by_name(sheet_name).iter_rows()
+        header = next(rows, [])
+        numbers = [number for number, column_name in enumerate(header) if self.use_column(column_name)]
+        columns = [header[number] for number in numbers]
+        batch = []
+        empty = True
+        for row in rows:
+            # Пустые строки пропускаются, как при чтении листа целиком
+            if all(value == '' for value in row):
+                continue
+            batch.append([self.convert_cell(row[number]) for number in numbers])
+            if len(batch) == self.batch_size:
+                yield DataFrame(batch, columns=columns)
+                batch = []
+                empty = False
+        if batch or empty:
+            yield DataFrame(batch, columns=columns)
+
+    def iter_xlwings(self, sheet) -> Iterator[DataFrame]:
+        """
+        Читает лист Excel через xlwings: каждая нужная колонка читается диапазонами по batch_size строк
+        :param sheet: лист xlwings
+        :return: части листа
+        """
+
+        header = sheet['A1'].expand('right').value
+        last_row = sheet['A1'].expand().last_cell.row
+        numbers = [number for number, column_name in enumerate(header, start=1) if self.use_column(column_name)]
+        for first_row in range(2, max(last_row, 2) + 1, self.batch_size):
+            last = min(first_row + self.batch_size - 1, last_row)
+            if last < first_row:
+                yield DataFrame(columns=[header[number - 1] for number in numbers])
+                break
+            yield DataFrame({header[number - 1]: sheet.range((first_row, number), (last, number)).options(ndim=1).value for number in numbers})
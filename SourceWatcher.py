@@ -0,0 +1,49 @@
+import os
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+import loguru
+
+
+class SourceWatcher:
+    """
+    Отслеживает изменения файлов с данными опросом os.stat(): сетевые папки не поддерживают уведомления файловой системы.
+    Изменение считается завершенным, когда размер и время изменения файлов не меняются в течение settle секунд,
+    чтобы не читать файл, который еще копируется.
+    """
+
+    def __init__(self, paths: list[Union[str, Path]], interval: float = 60.0, settle: float = 10.0):
+        self.paths = paths
+        self.interval = interval
+        self.settle = settle
+        self.state: Optional[tuple[tuple[int, int], ...]] = None
+        self.logger = loguru.logger
+
+    def _stat(self) -> Optional[tuple[tuple[int, int], ...]]:
+        """ Размер и время изменения каждого файла. None - какой-то из файлов недоступен (например, перезаписывается) """
+        try:
+            stats = [os.stat(path) for path in self.paths]
+        except OSError as ex:
+            self.logger.debug(f'Файл с данными недоступен: {ex}')
+            return None
+        return tuple((stat.st_size, stat.st_mtime_ns) for stat in stats)
+
+    def wait_for_change(self) -> None:
+        """
+        Ожидает изменения файлов. Первый вызов возвращается сразу, если файлы доступны
+        """
+
+        while True:
+            state = self._stat()
+            if state is not None and state != self.state:
+                if self.state is None:
+                    self.state = state
+                    return
+                time.sleep(self.settle)
+                if self._stat() == state:
+                    self.state = state
+                    return
+                self.logger.debug('Файлы с данными еще изменяются')
+                continue
+            time.sleep(self.interval)
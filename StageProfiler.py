@@ -0,0 +1,126 @@
+import cProfile
+import csv
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Union
+
+import loguru
+
+
+def current_rss() -> Optional[int]:
+    """
+    Текущий объем памяти процесса (RSS) в байтах. Требует psutil, без него возвращает None
+    """
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Максимальный объем памяти процесса (RSS) с момента запуска в байтах. В Windows требует psutil
+    """
+    if sys.platform == 'win32':
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset
+    import resource
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает килобайты, macOS - байты
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class StageProfiler:
+    """
+    Замеры этапов формирования отчета: время, процессорное время, память, размеры данных.
+    Выключенный профилировщик ничего не замеряет и не влияет на скорость работы.
+    """
+
+    def __init__(self, enabled: bool = False, trace_memory: bool = False, cprofile_dir: Union[str, Path] = None):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.cprofile_dir = Path(cprofile_dir) if enabled and cprofile_dir is not None else None
+        self.records: list[dict] = []
+        self.logger = loguru.logger
+        # cProfile не допускает одновременной работы нескольких профилировщиков: вложенные и параллельные этапы без него
+        self._cprofile_lock = threading.Lock()
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.cprofile_dir is not None:
+            self.cprofile_dir.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def stage(self, stage: str, **details):
+        """
+        Замеряет этап. В возвращаемый словарь можно добавить собственные показатели этапа (количество строк и т.п.)
+        :param stage: имя этапа
+        :param details: дополнительные параметры этапа (имя листа, период)
+        :return: словарь с замерами этапа
+        """
+
+        record = {'stage': stage, **details}
+        if not self.enabled:
+            yield record
+            return
+
+        profile = None
+        if self.cprofile_dir is not None and self._cprofile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            profile.enable()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_time'] = time.perf_counter() - wall_start
+            record['cpu_time'] = time.process_time() - cpu_start
+            record['rss'] = current_rss()
+            record['peak_rss'] = peak_rss()
+            if self.trace_memory:
+                record['traced_peak'] = tracemalloc.get_traced_memory()[1]
+            if profile is not None:
+                profile.disable()
+                name = '_'.join(str(part) for part in [len(self.records), stage, details.get('sheet')] if part is not None)
+                profile.dump_stats(Path(self.cprofile_dir, f'{name}.prof'))
+                self._cprofile_lock.release()
+            self.logger.debug(f'Этап {record}')
+            self.records.append(record)
+
+    def save(self, file_name: Union[str, Path]) -> None:
+        """
+        Сохраняет замеры в файл .json или .csv (по расширению файла)
+        :param file_name: имя файла
+        """
+
+        if Path(file_name).suffix.lower() == '.csv':
+            fieldnames = list(dict.fromkeys(key for record in self.records for key in record))
+            with open(file_name, 'w', encoding='utf-8-sig', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=';')
+                writer.writeheader()
+                writer.writerows(self.records)
+        else:
+            with open(file_name, 'w', encoding='utf-8') as f:
+                json.dump(self.records, f, ensure_ascii=False, indent=2, default=str)
+
+    def summary(self, top: int = 10) -> list[str]:
+        """
+        Самые долгие этапы для вывода в консоль
+        :param top: количество этапов
+        :return: строки с описанием этапов
+        """
+
+        lines = []
+        for record in sorted(self.records, key=lambda r: r['wall_time'], reverse=True)[:top]:
+            details = ', '.join(f'{key}={value}' for key, value in record.items() if key not in ('stage', 'wall_time', 'cpu_time', 'rss', 'peak_rss', 'traced_peak'))
+            lines.append(f'{record["stage"]:>20}: {record["wall_time"]:8.3f} с  {details}')
+        return lines
@@ -0,0 +1,83 @@
+import sys
+
+import loguru
+import xlsxwriter
+from xlsxwriter.utility import xl_range
+from pandas import DataFrame
+
+from FormattedWorkbook import dataframe_columns_width
+
+
+class StreamingWorkbook:
+    """
+    Книга отчета на xlsxwriter в режиме constant_memory: строки листа выгружаются на диск по мере записи,
+    поэтому в памяти не остаются ячейки всех листов до сохранения файла.
+    Интерфейс совпадает с FormattedWorkbook в той части, которую использует WeeklyReport.
+    """
+
+    CHUNK_SIZE = 10_000
+
+    def __init__(self, logging_level='ERROR', table_style='TableStyleMedium2'):
+        self.logging_level = logging_level
+        self.logger = loguru.logger
+        self.table_style = table_style
+        self.workbook = xlsxwriter.Workbook(options={
+            'constant_memory': True,
+            'strings_to_urls': False,
+            'default_date_format': 'yyyy-mm-dd h:mm:ss',
+        })
+        self.ws = None
+
+    @property
+    def worksheets(self) -> list:
+        return self.workbook.worksheets()
+
+    @property
+    def active(self):
+        """ В отличие от openpyxl, листа по умолчанию нет """
+        return None
+
+    def remove(self, worksheet) -> None:
+        """ Лист по умолчанию не создается, удалять нечего """
+        if worksheet is not None:
+            raise ValueError('xlsxwriter не поддерживает удаление листов')
+
+    def excel_format_table(self, df: DataFrame, save_sheet_name: str, save_table_name: str):
+        """ Метод обеспечивает форматирование листа Excel с таблицей."""
+        self.logger.remove()
+        self.logger.add(sys.stdout, level=self.logging_level)
+        self.logger.info(f'Создаем лист "{save_sheet_name}"')
+        self.ws = self.workbook.add_worksheet(f'{save_sheet_name}')
+        self.logger.info(f'Выравниваем поля по размеру в таблице "{save_table_name}"')
+        for _number, _width in enumerate(dataframe_columns_width(df)):
+            self.ws.set_column(_number, _number, _width)
+        headers = [str(_name) for _name in df.columns]
+        self.logger.info(f'Форматирует таблицу "{save_table_name}"')
+        self.logger.debug(f'Таблица для форматирования: {xl_range(0, 0, len(df), len(df.columns) - 1)}')
+        # xlsxwriter запрещает add_table() в режиме constant_memory только из-за записи заголовков в общую таблицу строк.
+        # Таблица добавляется до записи данных, а заголовки сразу перезаписываются строками в режиме constant_memory.
+        # Worksheet.constant_memory - внутренний атрибут xlsxwriter, поэтому версия ограничена в requirements.txt,
+        # а ссылку и заголовки таблицы проверяет tests/test_streaming_workbook.py
+        self.ws.constant_memory = False
+        result = self.ws.add_table(0, 0, max(len(df), 1), len(df.columns) - 1, {
+            'name': save_table_name,
+            'style': self.table_style,
+            'banded_rows': True,
+            'banded_columns': True,
+            'columns': [{'header': _header} for _header in headers],
+        })
+        self.ws.constant_memory = True
+        # При ошибке параметров add_table() только выводит предупреждение и возвращает отрицательный код
+        if result != 0:
+            raise ValueError(f'Не удалось добавить таблицу "{save_table_name}" на лист "{save_sheet_name}", код ошибки xlsxwriter: {result}')
+        self.ws.write_row(0, 0, headers)
+        self.logger.info(f'Заполняем лист "{save_sheet_name}" данными')
+        for _start in range(0, len(df), self.CHUNK_SIZE):
+            _chunk = df.iloc[_start:_start + self.CHUNK_SIZE]
+            _chunk = _chunk.astype(object).where(_chunk.notna(), None)
+            for _number, _row in enumerate(_chunk.itertuples(index=False, name=None), start=_start + 1):
+                self.ws.write_row(_number, 0, _row)
+
+    def save(self, filename) -> None:
+        self.workbook.filename = filename
+        self.workbook.close()
@@ -0,0 +1,263 @@
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from Colors import Colors
+from FormattedWorkbook import FormattedWorkbook
+from ReportPeriod import ReportPeriod
+from ReportPlanner import SHEET_SPECS
+from StreamingWorkbook import StreamingWorkbook
+from weekly_report_class import PROGRAM_VERSION, WeeklyReport
+
+# В Excel не больше 1 048 576 строк на листе, включая заголовок
+EXCEL_MAX_ROWS = 1_048_575
+# Целевое время запуска weekly_report_class.py --help, секунд
+STARTUP_TARGET = 1.0
+# Модули, которые не должны импортироваться при запуске программы, только при использовании
+LAZY_MODULES = ('xlwings', 'xlrd', 'openpyxl', 'xlsxwriter', 'python_calamine', 'polars')
+
+
+def make_synthetic_data(rows: int, ro_cluster: pd.DataFrame, year: int, seed: int = 0) -> dict[str, pd.DataFrame]:
+    """
+    Формирует синтетические листы 'Массив' и 'mdp_upload_date' с колонками, которые используют report_kpi и make_report
+    :param rows: количество строк листа 'Массив'
+    :param ro_cluster: соответствие кластеров и региональных отделений
+    :param year: год отчета, даты распределены с середины предыдущего до середины следующего года
+    :param seed: начальное значение генератора случайных чисел
+    :return: словарь {имя листа: данные}
+    """
+
+    rng = np.random.default_rng(seed)
+    business_processes = sorted({bp for spec in SHEET_SPECS for bp in spec.business_processes}) + ['Pico Cell_Включение', 'Демонтаж БС/АМС']
+    programs = [spec.program for spec in SHEET_SPECS if spec.program is not None] + [f'КФ. Развитие регионов. {year}', f'КФ. Развитие регионов. {year - 1}']
+    regions = rng.integers(0, len(ro_cluster), rows)
+
+    def random_dates(empty_share: float) -> np.ndarray:
+        first_day = np.datetime64(f'{year - 1}-07-01')
+        dates = (first_day + rng.integers(0, 730, rows).astype('timedelta64[D]')).astype('datetime64[ns]')
+        dates[rng.random(rows) < empty_share] = np.datetime64('NaT')
+        return dates
+
+    def random_flags(share: float) -> np.ndarray:
+        return np.where(rng.random(rows) < share, 1.0, np.nan)
+
+    massiv = pd.DataFrame({
+        'ID_ESUP': np.arange(rows) + 1_000_000,
+        'BP_ESUP': np.array(business_processes, dtype=object)[rng.integers(0, len(business_processes), rows)],
+        'PROGRAM': np.array(programs, dtype=object)[rng.integers(0, len(programs), rows)],
+        'CHECK_PLAN': np.where(rng.random(rows) < 0.8, 'Да', 'Нет').astype(object),
+        'CHECK_FACT': random_flags(0.4),
+        'RO': ro_cluster['RO'].to_numpy(dtype=object)[regions],
+        'RO_CLUSTER': ro_cluster['RO_CLUSTER'].to_numpy(dtype=object)[regions],
+        'NAZ': pd.Series(np.arange(rows)).map('Объект {}'.format).to_numpy(dtype=object),
+        'CHECK_NEW_PLAN': np.where(rng.random(rows) < 0.5, 'Новая', 'Существующая').astype(object),
+        'PO': np.where(rng.random(rows) < 0.3, 'Работы своими силами', 'ПО строительства').astype(object),
+        'PLAN_DATE_END': random_dates(0.1),
+        'PROGNOZ_DATE': random_dates(0.1),
+        'PROGNOZ_COMMENT': np.where(rng.random(rows) < 0.3, 'Перенос сроков', None).astype(object),
+        'MIN_DATE_FACT': random_dates(0.6),
+        'Выдача оборудования': random_flags(0.5),
+        'Комплект 48-х': random_flags(0.3),
+        'НП': random_flags(0.2),
+        'PLAN_YEAR': rng.integers(year - 1, year + 1, rows),
+    })
+    upload_date = pd.DataFrame({'DATE_UPLOAD': [pd.Timestamp(datetime.datetime(year, 5, 20, 6, 0))]})
+    return {'Массив': massiv, 'mdp_upload_date': upload_date}
+
+
+def write_source_file(data: dict[str, pd.DataFrame], file_name: Path) -> None:
+    """
+    Записывает синтетические данные в .xlsx. Формат .xlsb из Python не записывается,
+    calamine читает оба формата одним и тем же кодом, поэтому .xlsx используется как его эквивалент
+    :param data: словарь {имя листа: данные}
+    :param file_name: имя файла
+    """
+
+    wb = StreamingWorkbook()
+    for number, (sheet_name, _df) in enumerate(data.items()):
+        wb.excel_format_table(_df, sheet_name, f'source_{number}')
+    wb.save(file_name)
+
+
+def measure(stage: str, func: Callable, trace_memory: bool) -> tuple[object, dict]:
+    """
+    Замеряет время выполнения этапа и, отдельным повторным запуском, пиковое потребление памяти
+    :param stage: имя этапа
+    :param func: функция без параметров
+    :param trace_memory: выполнить дополнительный запуск под tracemalloc
+    :return: результат функции и словарь с замерами
+    """
+
+    print(f'Замеряем этап {Colors.GREEN}"{stage}"{Colors.END}')
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    result = func()
+    stats = {'wall_time': time.perf_counter() - wall_start, 'cpu_time': time.process_time() - cpu_start}
+    if trace_memory:
+        tracemalloc.start()
+        func()
+        stats['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, stats
+
+
+def measure_startup(repeat: int = 5) -> dict:
+    """
+    Замеряет время запуска программы с ключом --help в отдельном процессе и проверяет, какие модули импортируются при запуске
+    :param repeat: количество запусков, в результат попадает медиана
+    :return: результаты замеров
+    """
+
+    script = Path(Path(__file__).parent, 'weekly_report_class.py')
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, str(script), '--help'], check=True, capture_output=True)
+        times.append(time.perf_counter() - start)
+    imported = subprocess.run([sys.executable, '-c', f'import sys, weekly_report_class; print(*[m for m in {LAZY_MODULES!r} if m in sys.modules])'],
+                              check=True, capture_output=True, text=True, cwd=script.parent).stdout.split()
+    result = {'help_time': statistics.median(times), 'target': STARTUP_TARGET, 'imported_lazy_modules': imported}
+    color = Colors.GREEN if result['help_time'] <= STARTUP_TARGET and not imported else Colors.RED
+    print(f'Запуск с --help: {color}{result["help_time"]:.3f} с{Colors.END} (цель {STARTUP_TARGET:.1f} с)'
+          + (f', {Colors.RED}при запуске импортируются: {", ".join(imported)}{Colors.END}' if imported else ''))
+    return result
+
+
+def check_engine_parity(wr: WeeklyReport, df_kpi: pd.DataFrame) -> list[str]:
+    """
+    Сравнивает сводные таблицы всех листов, рассчитанные pandas (make_report) и polars (make_polars_reports),
+    за период отчета, за период на стыке лет и за каждую ISO неделю периода отчета, как в пакетном режиме --every week
+    :param wr: параметры отчета
+    :param df_kpi: исходные данные
+    :return: листы и периоды, таблицы которых различаются
+    """
+
+    year = wr.period.begin_date.year
+    periods = [wr.period, ReportPeriod.from_dates(datetime.date(year - 1, 12, 1), datetime.date(year, 1, 31))] + wr.period.split('week')
+    planner = wr.get_planner(df_kpi)
+    different = []
+    for period in periods:
+        indicators = wr.make_indicators(df_kpi, period)
+        for spec, report in zip(SHEET_SPECS, wr.make_polars_reports(df_kpi, list(SHEET_SPECS), period)):
+            expected = wr.make_report(df_kpi, divide_prognosis=spec.divide_prognosis, add_spec=spec.add_spec, rows=planner.rows(spec),
+                                      indicators=indicators, period=period)
+            if not expected.equals(report):
+                different.append(f'{spec.name} ({period.name})')
+    if different:
+        print(f'{Colors.RED}Сводные таблицы pandas и polars различаются: {", ".join(different)}{Colors.END}')
+    else:
+        print(f'Сводные таблицы pandas и polars {Colors.GREEN}совпадают{Colors.END} ({len(SHEET_SPECS)} листов, {len(periods)} периодов)')
+    return different
+
+
+def run_benchmark(rows: int, args: argparse.Namespace) -> dict:
+    """
+    Прогоняет этапы формирования отчета на синтетических данных
+    :param rows: количество строк листа 'Массив'
+    :param args: параметры запуска бенчмарка
+    :return: результаты замеров
+    """
+
+    data_dir = Path(args.data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    source_file = Path(data_dir, f'synthetic_{rows}_{args.year}_{args.seed}.xlsx')
+    report_file = Path(data_dir, f'synthetic_{rows}_report.xlsx')
+    # Источник подменяется после генерации данных, -s нужен только для проверки параметров
+    report_args = ['-s', str(Path(__file__)), '-r', str(report_file),
+                   '-b', f'{args.year}-05-01', '-e', f'{args.year}-05-31', '--experimental', '--no-cache', '--writer', args.writer]
+    wr = WeeklyReport(report_args)
+    stages = {}
+
+    data = make_synthetic_data(rows, wr.ro_cluster, args.year, args.seed)
+    if rows <= EXCEL_MAX_ROWS:
+        if not source_file.is_file():
+            print(f'Записываем синтетические данные в файл {Colors.GREEN}"{source_file}"{Colors.END}')
+            write_source_file(data, source_file)
+        # Свежая дата изменения, чтобы get_data не спрашивал про устаревшие данные
+        os.utime(source_file)
+        wr.urls = [source_file]
+
+        def get_data() -> dict[str, pd.DataFrame]:
+            # get_data переиспользует уже прочитанные файлы, поэтому повторный запуск под tracemalloc тоже читает файл заново
+            wr.sources = {}
+            wr.data = None
+            return wr.get_data()
+
+        data, stages['get_data'] = measure('get_data', get_data, args.memory)
+    else:
+        print(f'{Colors.YELLOW}{rows} строк не помещаются на лист Excel, этап get_data пропущен{Colors.END}')
+
+    df_kpi = data[wr.sheets[0]]
+    wr.upload_date = data[wr.sheets[1]]
+    _, stages['make_report'] = measure('make_report', lambda: wr.make_report(df_kpi), args.memory)
+    engine_parity = None
+    if importlib.util.find_spec('polars') is not None:
+        _, stages['make_polars_reports'] = measure('make_polars_reports', lambda: wr.make_polars_reports(df_kpi, list(SHEET_SPECS)), args.memory)
+        engine_parity = check_engine_parity(wr, df_kpi)
+    wb, stages['report_kpi'] = measure('report_kpi', lambda: wr.report_kpi(df_kpi), args.memory)
+
+    # Форматирование самого большого листа отчета в отдельной книге
+    largest_sheet, largest_df = max(wr.make_sheets(df_kpi), key=lambda sheet: len(sheet[1]))
+    workbook_class = StreamingWorkbook if args.writer == 'xlsxwriter' else FormattedWorkbook
+    _, stages['excel_format_table'] = measure('excel_format_table',
+                                              lambda: workbook_class().excel_format_table(largest_df, largest_sheet, wr.report_sheets[largest_sheet]),
+                                              args.memory)
+    # Книгу xlsxwriter можно сохранить только один раз, поэтому замер памяти сохранения выполняется на новой книге
+    _, stages['save_report'] = measure('save_report', lambda: wr.save_report(wb), False)
+    if args.memory:
+        wb = wr.report_kpi(df_kpi)
+        tracemalloc.start()
+        wr.save_report(wb)
+        stages['save_report']['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    for stage, stats in stages.items():
+        print(f'{stage:>20}: {stats["wall_time"]:8.3f} с' + (f', {stats["peak_memory"] / 2 ** 20:8.1f} МБ' if 'peak_memory' in stats else ''))
+    return {'rows': rows, 'ap_rows': len(largest_df), 'stages': stages, 'engine_parity_mismatches': engine_parity}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f'Бенчмарк weekly_report_class v.{PROGRAM_VERSION} на синтетических данных')
+    parser.add_argument("--rows", type=int, nargs='+', default=[10_000, 100_000, 1_000_000], help="Размеры листа 'Массив', от 10 тыс. до 5 млн. строк")
+    parser.add_argument("--year", type=int, default=2025, help="Год отчета")
+    parser.add_argument("--seed", type=int, default=0, help="Начальное значение генератора случайных чисел")
+    parser.add_argument("--writer", choices=['openpyxl', 'xlsxwriter'], default='openpyxl', help="Библиотека записи отчета")
+    parser.add_argument("--memory", action='store_true', help="Замерять пиковое потребление памяти (этапы выполняются повторно под tracemalloc)")
+    parser.add_argument("--data-dir", default='benchmark_data', help="Каталог для синтетических файлов данных и отчетов")
+    parser.add_argument("-o", "--output", help="Файл JSON с результатами")
+    args = parser.parse_args()
+    Colors.enable()
+
+    results = {
+        'version': PROGRAM_VERSION,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'writer': args.writer,
+        'startup': measure_startup(),
+        'runs': [run_benchmark(rows, args) for rows in args.rows],
+    }
+    output = Path(args.output) if args.output is not None else Path(f'benchmark_{PROGRAM_VERSION}_{datetime.date.today().strftime("%Y%m%d")}.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f'Результаты сохранены в файл {Colors.GREEN}"{output}"{Colors.END}')
+    # Расхождение pandas и polars - ошибка, а не результат замера: бенчмарк в CI должен завершиться с ошибкой
+    if any(run['engine_parity_mismatches'] for run in results['runs']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
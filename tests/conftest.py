@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Модули программы лежат в корне репозитория
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,74 @@
+import datetime
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlencode
+
+import pytest
+
+from benchmark import make_synthetic_data, write_source_file
+from ReportPeriod import ReportPeriod
+from ReportServer import ReportRequestHandler, ReportServer
+from weekly_report_class import WeeklyReport
+
+
+@pytest.fixture(scope='module')
+def source_file(tmp_path_factory):
+    source_file = tmp_path_factory.mktemp('server') / 'source.xlsx'
+    write_source_file(make_synthetic_data(2_000, WeeklyReport(['-s', __file__]).ro_cluster, 2025), source_file)
+    return source_file
+
+
+def make_report_server(source_file, *args: str) -> ReportServer:
+    return ReportServer(WeeklyReport(['-s', str(source_file), '-r', str(source_file.with_name('report.xlsx')), '--no-cache', '--serve', '0', *args]))
+
+
+@pytest.fixture(scope='module')
+def server_url(source_file):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ReportRequestHandler)
+    httpd.report_server = make_report_server(source_file, '-b', '2025-05-01', '-e', '2025-05-31')
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(server_url: str, endpoint: str, **params) -> tuple[int, dict]:
+    try:
+        with urllib.request.urlopen(f'{server_url}/{endpoint}?{urlencode(params)}') as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as ex:
+        return ex.code, json.load(ex)
+
+
+def test_report_by_cluster(server_url):
+    status, body = get(server_url, 'report', sheet='Энерго', cluster='Cluster C')
+    assert status == 200
+    assert body['cluster'] == 'Cluster C'
+    assert body['period'] == '2025-05-01 - 2025-05-31'
+    assert body['rows']
+
+
+@pytest.mark.parametrize('endpoint', ['report', 'ap'])
+def test_unknown_cluster_is_bad_request(server_url, endpoint):
+    status, body = get(server_url, endpoint, sheet='Энерго', cluster='Cluster Z')
+    assert status == 400
+    assert 'Cluster Z' in body['error']
+
+
+@pytest.mark.parametrize('endpoint', ['report', 'ap'])
+def test_begin_after_end_is_bad_request(server_url, endpoint):
+    status, body = get(server_url, endpoint, sheet='Энерго', begin='2025-06-01', end='2025-05-01')
+    assert status == 400
+    assert '2025-06-01' in body['error']
+
+
+def test_default_period_follows_current_month(source_file):
+    server = make_report_server(source_file)
+    # Сервис запущен в прошлом месяце
+    server.wr.period = ReportPeriod.from_dates(datetime.date(2025, 5, 1), datetime.date(2025, 5, 31))
+    body = json.loads(server.query('report', {'sheet': 'Энерго'}))
+    assert body['period'] == ReportPeriod.current_month(datetime.date.today()).name
@@ -0,0 +1,43 @@
+import datetime
+
+import openpyxl
+import pandas as pd
+
+from StreamingWorkbook import StreamingWorkbook
+
+
+def read_table(filename, sheet_name: str, table_name: str):
+    ws = openpyxl.load_workbook(filename)[sheet_name]
+    table = ws.tables[table_name]
+    return table, [[cell.value for cell in row] for row in ws[table.ref]]
+
+
+def test_table_ref_and_headers(tmp_path):
+    df = pd.DataFrame({
+        'RO': ['Сочи', 'Ростовская область', None],
+        'Кол-во': [1, 2, 3],
+        'Дата': [datetime.datetime(2025, 5, 1), None, datetime.datetime(2025, 5, 31)],
+    })
+    wb = StreamingWorkbook()
+    wb.excel_format_table(df, 'Энерго', 'energy_report')
+    wb.save(tmp_path / 'report.xlsx')
+
+    table, rows = read_table(tmp_path / 'report.xlsx', 'Энерго', 'energy_report')
+    assert table.ref == 'A1:C4'
+    assert [column.name for column in table.tableColumns] == ['RO', 'Кол-во', 'Дата']
+    assert rows == [
+        ['RO', 'Кол-во', 'Дата'],
+        ['Сочи', 1, datetime.datetime(2025, 5, 1)],
+        ['Ростовская область', 2, None],
+        [None, 3, datetime.datetime(2025, 5, 31)],
+    ]
+
+
+def test_empty_table_keeps_header_row(tmp_path):
+    wb = StreamingWorkbook()
+    wb.excel_format_table(pd.DataFrame(columns=['RO', 'Кол-во']), 'АП БС', 'ap_bs')
+    wb.save(tmp_path / 'report.xlsx')
+
+    table, rows = read_table(tmp_path / 'report.xlsx', 'АП БС', 'ap_bs')
+    assert table.ref == 'A1:B2'
+    assert rows[0] == ['RO', 'Кол-во']
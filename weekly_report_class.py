@@ -1,30 +1,80 @@
 import argparse
-import calendar
 import datetime
-import io
+import glob
+import importlib.util
 import locale
+import mmap
+import multiprocessing
 import os
 import sys
+import threading
 import warnings
-from functools import reduce
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path, PurePath
-from typing import Union
+from typing import Iterator, Union
 
+import numpy as np
 import pandas as pd
-import xlwings as xw
 from loguru import logger
-from xlrd import XLRDError
 
+from ChangeTracker import ChangeTracker, RowChanges
 from Colors import Colors
-from FormattedWorkbook import FormattedWorkbook
+from DataCache import DataCache, default_cache_dir
+from DateCube import DateCube, DateCubeBuilder
+from MemoryReport import MemoryReport
 from MyLoggingException import MyLoggingException
+from PolarsEngine import PolarsEngine
+from ReportPeriod import ReportPeriod, parse_date
+from ReportExporter import ReportExporter
+from ReportPlanner import METRICS, ReportPlanner, SHEET_SPECS, SheetSpec
+from ReportServer import ReportServer
+from SnapshotStore import SnapshotStore, default_history_file
+from SourceMirror import SourceMirror
+from SourceStream import SourceStream
+from SourceWatcher import SourceWatcher
+from StageProfiler import StageProfiler, peak_rss
 
 PROGRAM_NAME = Path(__file__).stem
 PROGRAM_VERSION = "0.6.2"
 
 
+def protected_file_errors() -> tuple[type[Exception], ...]:
+    """
+    Ошибки чтения файла с данными, после которых файл открывается через Excel (xlwings): защищенные паролем файлы.
+    Вызывается только при обработке исключения, поэтому xlrd и python_calamine не импортируются при запуске программы
+    :return: классы исключений
+    """
+
+    errors = []
+    try:
+        from xlrd import XLRDError
+        errors.append(XLRDError)
+    except ImportError:
+        pass
+    try:
+        from python_calamine import PasswordError
+        errors.append(PasswordError)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def period_argument(period_string: str) -> ReportPeriod:
+    """
+    Тип аргумента --periods: ошибка формата выводится argparse вместе с подсказкой по запуску
+    :param period_string: строка с периодом
+    :return: период анализа
+    """
+
+    try:
+        return ReportPeriod.parse(period_string)
+    except ValueError as ex:
+        raise argparse.ArgumentTypeError(str(ex)) from None
+
+
 class WeeklyReport:
-    def __init__(self):
+    def __init__(self, argv: list[str] = None):
         self.log_level = 'ERROR'
 
         today_datetime = datetime.datetime.now()
@@ -36,66 +86,126 @@ class WeeklyReport:
         self.parser.add_argument("-b", "--begin-date", type=str, help="Дата начала периода анализа формат YYYY-MM-DD")
         self.parser.add_argument("-e", "--end-date", type=str, help="Дата окончания периода анализа формат YYYY-MM-DD")
         self.parser.add_argument("--dont-save-ap", action='store_true', help="Не сохранять адресные планы вместе с отчетом")
-        self.parser.add_argument("-s", "--source-file", help="Файл с данными")
+        self.parser.add_argument("-s", "--source-file", nargs='+',
+                                 help="Файлы с данными или шаблоны имен (*.xlsb). Несколько файлов читаются параллельно и объединяются, "
+                                      "при совпадении ID_ESUP остаются строки файла, указанного позже")
         self.parser.add_argument("-r", "--report-file", help="Имя файла с отчетом. Должен иметь расширение .xlsx")
         self.parser.add_argument("--experimental", action='store_true', help="Включить в отчет экспериментальные разделы")
-        self.args = self.parser.parse_args()
+        self.parser.add_argument("-j", "--jobs", type=int, default=1, help="Количество потоков для расчета листов отчета")
+        self.parser.add_argument("--writer", choices=['openpyxl', 'xlsxwriter'], default='openpyxl',
+                                 help="Библиотека записи отчета. xlsxwriter пишет строки на диск по мере формирования листов")
+        self.parser.add_argument("--memory-report", action='store_true', help="Вывести объем памяти по колонкам исходных данных и производным таблицам")
+        self.parser.add_argument("--memory-budget", type=float, metavar='MB', help="Предупреждать, если пиковый объем памяти процесса превысил MB мегабайт")
+        self.parser.add_argument("--export", nargs='+', choices=ReportExporter.FORMATS,
+                                 help="Дополнительно сохранить листы отчета в форматах parquet, csv и/или json для внешних систем")
+        self.parser.add_argument("--export-dir", help="Каталог выгрузки --export. По умолчанию каталог с именем файла отчета")
+        self.parser.add_argument("--no-xlsx", action='store_true', help="Не формировать файл отчета .xlsx, только выгрузка --export")
+        self.parser.add_argument("--cube", action='store_true',
+                                 help="Считать сводные таблицы по накопительным счетчикам дат (быстрее для нескольких периодов)")
+        self.parser.add_argument("--incremental", action='store_true',
+                                 help="Пересчитывать счетчики сводных таблиц (как --cube) только по строкам, измененным с предыдущей загрузки, "
+                                      "и добавлять в отчет лист 'Изменения'")
+        self.parser.add_argument("--engine", choices=['pandas', 'polars'], default='pandas',
+                                 help="Библиотека расчета сводных таблиц. polars выполняет запросы листов параллельно, результат совпадает с pandas")
+        self.parser.add_argument("--stream", action='store_true',
+                                 help="Читать лист 'Массив' частями: сводные таблицы считаются по счетчикам дат (как --cube), "
+                                      "в памяти остаются только строки адресных планов периодов отчета. Кэш данных не используется")
+        self.parser.add_argument("--split-clusters", action='store_true',
+                                 help="Отдельный отчет для каждого кластера (RO_CLUSTER): те же листы и АП только по регионам кластера. "
+                                      "Отчеты кластеров формируются параллельно в отдельных процессах из одной загрузки данных")
+        self.parser.add_argument("--history", action='store_true',
+                                 help="Сохранять сводные таблицы в хранилище истории и добавлять в отчет лист 'Динамика' по прошлым выгрузкам")
+        self.parser.add_argument("--history-file", help="Файл хранилища истории --history (SQLite). По умолчанию в каталоге данных программы")
+        self.parser.add_argument("--watch", action='store_true',
+                                 help="Режим ожидания: следить за файлом с данными и пересоздавать отчеты после каждого его изменения")
+        self.parser.add_argument("--watch-interval", type=float, default=60.0, help="Интервал проверки файла с данными в режиме --watch, секунд")
+        self.parser.add_argument("--serve", type=int, metavar='PORT', help="Запустить локальный HTTP/JSON сервис выборок на порту PORT")
+        self.parser.add_argument("--host", default='127.0.0.1', help="Адрес сервиса выборок --serve")
+        self.parser.add_argument("--stale-data", choices=['ask', 'continue', 'abort'],
+                                 help="Что делать с данными старше 3 часов: спросить (по умолчанию), продолжить или прервать обработку. "
+                                      "В режиме --watch по умолчанию continue, abort пропускает обработку до следующего изменения файла")
+        self.parser.add_argument("--mirror", choices=['auto', 'always', 'never'], default='auto',
+                                 help="Читать файлы с данными из локальной копии: auto - только файлы на сетевом диске, always - все файлы, never - не копировать")
+        self.parser.add_argument("--mirror-dir", help="Каталог локальных копий файлов с данными. По умолчанию подкаталог mirror каталога кэша")
+        self.parser.add_argument("--cache-dir", help="Каталог для кэша разобранных данных")
+        self.parser.add_argument("--no-cache", action='store_true', help="Не использовать кэш разобранных данных")
+        self.parser.add_argument("--clear-cache", action='store_true', help="Очистить кэш разобранных данных перед обработкой")
+        self.parser.add_argument("--profile", metavar='FILE', help="Сохранить замеры времени и памяти по этапам в файл .json или .csv")
+        self.parser.add_argument("--profile-tracemalloc", action='store_true', help="Дополнительно замерять пиковое выделение памяти через tracemalloc (замедляет работу)")
+        self.parser.add_argument("--profile-cprofile", metavar='DIR', help="Сохранять результаты cProfile по каждому этапу в каталог")
+        period_group = self.parser.add_mutually_exclusive_group()
+        period_group.add_argument("--periods", nargs='+', metavar='BEGIN:END', type=period_argument,
+                                  help="Пакетный режим: отчеты за несколько периодов формата YYYY-MM-DD:YYYY-MM-DD из одной загрузки данных")
+        period_group.add_argument("--every", choices=['week', 'month', 'quarter'],
+                                  help="Пакетный режим: отчеты за каждую ISO неделю, месяц или квартал периода --begin-date - --end-date")
+        self.argv = sys.argv[1:] if argv is None else list(argv)
+        self.args = self.parser.parse_args(argv)
+        if self.args.no_xlsx and self.args.export is None:
+            self.parser.error('--no-xlsx используется только вместе с --export')
+        if self.args.engine == 'polars' and (self.args.cube or self.args.stream or self.args.incremental):
+            self.parser.error('--engine polars не используется вместе с --cube, --stream и --incremental: сводные таблицы считаются по счетчикам дат')
+        if self.args.incremental and (self.args.stream or self.args.split_clusters):
+            self.parser.error('--incremental не используется вместе с --stream и --split-clusters')
+        if self.args.engine == 'polars' and importlib.util.find_spec('polars') is None:
+            self.parser.error('Для --engine polars нужно установить пакет polars')
+        if self.args.split_clusters and (self.args.stream or self.args.history or self.args.serve is not None):
+            self.parser.error('--split-clusters не используется вместе с --stream, --history и --serve')
+        if self.args.stream and self.args.serve is not None:
+            self.parser.error('--stream не используется вместе с --serve: сервису выборок нужны все строки данных')
 
-        if self.args.begin_date is None:
-            self.begin_date = datetime.datetime(today_datetime.year, today_datetime.month, 1)
-            save_begin_date: str = self.begin_date.strftime('%Y-%m-%d')
-            # self.begin_date = self.begin_date.strftime('%Y-%m-%d %H:%M:%S')
-        else:
-            save_begin_date: str = self.args.begin_date
-            split_begin_date: list[int] = list(map(int, save_begin_date.split('-')))
-            self.begin_date = datetime.datetime(year=split_begin_date[0], month=split_begin_date[1], day=split_begin_date[2], hour=0, minute=0, second=0)
-
-        # Дата конца анализа
-        if self.args.end_date is None:
-            self.end_date = datetime.datetime(year=today_datetime.year, month=today_datetime.month, day=calendar.monthrange(today_datetime.year, today_datetime.month)[1], hour=23,
-                                              minute=59, second=59, microsecond=99999)
-            save_end_date = self.end_date.strftime('%Y-%m-%d')
-        else:
-            save_end_date = self.args.end_date
-            split_end_date: list[int] = list(map(int, save_end_date.split('-')))
-            self.end_date = datetime.datetime(year=split_end_date[0], month=split_end_date[1], day=split_end_date[2], hour=23, minute=59, second=59, microsecond=99999)
-            # self.end_date = f'{self.args.end_date} {datetime.time(hour=23, minute=59, second=59, microsecond=99999).strftime("%H:%M:%S")}'
-
-        if self.begin_date.year == self.end_date.year:
-            self.process_year = [self.begin_date.year]
-        else:
-            self.process_year = [self.begin_date.year, self.end_date.year]
-
-        self.begin_of_the_year = datetime.datetime(year=self.begin_date.year, month=1, day=1)
-        self.end_of_the_year = datetime.datetime(year=self.end_date.year, month=12, day=31, hour=23, minute=59, second=59, microsecond=99999)
+        try:
+            self.set_period(today_datetime.date())
+        except ValueError as ex:
+            self.parser.error(str(ex))
 
-        if self.args.source_file is None:
-            self.url = Path(f'//megafon.ru/KVK/KRN/Files/TelegrafFiles/ОПРС/!Проекты РЦРП/Блок №3/{self.process_year[0]} год/MDP_24_25.xlsb')
-        else:
-            if Path(self.args.source_file).is_file():
-                self.url = self.args.source_file
-            else:
-                print(f'{Colors.RED}Файл с данными {self.args.source_file} не найден{Colors.END}')
-                sys.exit(130)
+        if self.args.source_file is not None:
+            self.urls = []
+            for source_file in self.args.source_file:
+                source_files = sorted(glob.glob(source_file)) if glob.has_magic(source_file) else [source_file]
+                if len(source_files) == 0 or not all(Path(url).is_file() for url in source_files):
+                    print(f'{Colors.RED}Файл с данными {source_file} не найден{Colors.END}')
+                    sys.exit(130)
+                self.urls += [Path(url) for url in source_files if Path(url) not in self.urls]
 
         if self.args.report_file is None:
             self.dir_name = Path('//megafon.ru/KVK', 'KRN', 'Files', 'TelegrafFiles', 'ОПРС', '!Проекты РЦРП', 'Блок №3', f'{datetime.datetime.today().year} год', 'Отчеты')
-            if self.args.dont_save_ap:
-                self.report_file = Path(self.dir_name, f'{datetime.date.today().strftime("%Y%m%d")} Отчет по выполнению мероприятий КФ ({save_begin_date} - {save_end_date}).xlsx')
-            else:
-                self.report_file = Path(self.dir_name,
-                                        f'{datetime.date.today().strftime("%Y%m%d")} Отчет по выполнению мероприятий КФ ({save_begin_date} - {save_end_date}) (АП).xlsx')
         else:
             if os.access(PurePath(self.args.report_file).parents[0], os.W_OK):
-                self.report_file = Path(self.args.report_file)
                 self.dir_name = PurePath(self.args.report_file).parents[0]
             else:
                 print(f'{Colors.RED}Не могу записать файл отчета {self.args.report_file}{Colors.END}')
                 sys.exit(140)
+        # Кластер отчета в режиме --split-clusters, задается в процессе, который формирует отчет кластера
+        self.cluster: str = None
+        self.report_file = self.make_report_file(self.period)
 
         self.sheets = ['Массив', 'mdp_upload_date']
 
+        self.cache = DataCache(self.args.cache_dir if self.args.cache_dir is not None else default_cache_dir(PROGRAM_NAME))
+        if self.args.clear_cache:
+            print(f'Очищаем кэш данных {Colors.GREEN}"{self.cache.cache_dir}"{Colors.END}')
+            self.cache.clear()
+
+        self.history = SnapshotStore(self.args.history_file if self.args.history_file is not None else default_history_file(PROGRAM_NAME))
+
+        # Предыдущая загрузка для --incremental хранится рядом с кэшем, с --no-cache - только в памяти (режим --watch)
+        self.tracker = ChangeTracker(None if self.args.no_cache else Path(self.cache.cache_dir, 'changes'))
+        self.changes: pd.DataFrame = None
+
+        self.mirror = SourceMirror(self.args.mirror_dir if self.args.mirror_dir is not None else Path(self.cache.cache_dir, 'mirror'))
+
+        if self.args.stale_data is None:
+            self.args.stale_data = 'continue' if self.args.watch else 'ask'
+
         self.upload_date: pd.DataFrame = pd.DataFrame()
+        # Последние загруженные данные и, по каждому файлу, хэш содержимого и данные файла
+        self.data: dict[str, pd.DataFrame] = None
+        self.sources: dict[Path, tuple[str, dict[str, pd.DataFrame]]] = {}
+        self.planner: ReportPlanner = None
+        self.cube: DateCube = None
+        self.engine: PolarsEngine = None
+        self.memory = MemoryReport(enabled=self.args.memory_report)
+        self.profiler = StageProfiler(enabled=self.args.profile is not None, trace_memory=self.args.profile_tracemalloc, cprofile_dir=self.args.profile_cprofile)
         self.ro_cluster = pd.DataFrame([['Cluster A', 'Белгородская область'],
                                         ['Cluster A', 'Воронежская область'],
                                         ['Cluster A', 'Липецкая область'],
@@ -113,43 +223,445 @@ class WeeklyReport:
                                         ['Cluster E', 'Республика Адыгея']],
                                        columns=['RO_CLUSTER', 'RO'])
 
-    def get_data(self) -> Union[pd.DataFrame, dict[str, pd.DataFrame]]:
+        self.report_sheets = {
+            'Всего БС': 'all_bs_report',
+            'Новые БС': 'new_bs_report',
+            'Существующие БС': 'exist_bs_report',
+            'РРЛ': 'rrl_report',
+            'Энерго': 'energy_report',
+            'Энерго ПО строительства': 'energy_report_po',
+            'Энерго ПО ПЭ': 'energy_report_self_do',
+            'Климатика': 'climate_report',
+            'Климатика ПО строительства': 'climate_report_po',
+            'Климатика ПО ПЭ': 'climate_report_self_do',
+            'АП БС': 'ap_all_bs',
+            'АП РРЛ': 'ap_rrl',
+            'АП Энерго': 'ap_energy',
+            'АП Климатика': 'ap_climate',
+            'Дата выгрузки данных': 'upload_date',
+            'IPBH': 'ipbh_report',
+            'ВОЛС': 'vols_report',
+            'АП IPBH': 'ap_ipbh',
+            'АП ВОЛС': 'ap_vols',
+            'АКБ': 'akb_report',
+            'Динамика': 'trend_report',
+            'Изменения': 'changes_report',
+        }
+        # Показатели строки ИТОГО: листов, которые выводятся на лист 'Динамика'
+        self.trend_columns = ['Оперплан', 'Прогноз', 'Факт', f'{chr(0x0394)}']
+
+        # Колонки адресных планов и их названия в отчете
+        self.report_columns = [
+            'ID_ESUP',
+            'BP_ESUP',
+            'PROGRAM',
+            'CHECK_PLAN',
+            'CHECK_FACT',
+            'RO',
+            'RO_CLUSTER',
+            'NAZ',
+            'CHECK_NEW_PLAN',
+            'PO',
+            'PLAN_DATE_END',
+            'PROGNOZ_DATE',
+            'PROGNOZ_COMMENT',
+            'MIN_DATE_FACT',
+            'Выдача оборудования',
+            'Комплект 48-х',
+            'НП',
+        ]
+        # Колонки листа 'Массив', которые загружаются для отчета, и их типы
+        self.source_columns = self.report_columns + ['PLAN_YEAR']
+        self.date_columns = ['PLAN_DATE_END', 'PROGNOZ_DATE', 'MIN_DATE_FACT']
+        self.flag_columns = ['CHECK_FACT', 'Выдача оборудования', 'Комплект 48-х', 'НП']
+        self.category_columns = ['BP_ESUP', 'RO', 'RO_CLUSTER', 'PO', 'PROGRAM', 'CHECK_PLAN', 'CHECK_NEW_PLAN']
+        self.integer_columns = ['ID_ESUP', 'PLAN_YEAR']
+
+        self.ap_rename_columns = {
+            'ID_ESUP': 'ЕСУП ID',
+            'SAP_EVT': 'SAP EVT',
+            'BP_ESUP': 'Бизнес процесс',
+            'RO': 'Региональное отделение',
+            'CHECK_NEW_PLAN': 'Новая/Существующая',
+            'NAZ': 'Наименование',
+            'PLAN_DATE_END': 'Плановая дата',
+            'PROGNOZ_DATE': 'Прогнозная дата',
+            'PROGNOZ_COMMENT': 'Комментарий к прогнозной дате',
+            'RS_2023': 'RAN Sharing 2023',
+            'MIN_DATE_FACT': 'Мин. дата запуска',
+            'MAX_DATE_FACT': 'Макс. дата запуска',
+            'PROGRAM': 'Программа',
+            'CHECK_FACT': 'Факт запуска',
+            'RO_CLUSTER': 'Кластер',
+            'build_priority': 'Приоритет',
+            'Выдача оборудования': 'Выдача оборудования',
+            '83_done': 'Выдача по 83',
+        }
+
+    @property
+    def default_period(self) -> bool:
+        """ Период не задан параметрами запуска: отчет за текущий месяц """
+        return self.args.begin_date is None and self.args.end_date is None and self.args.periods is None
+
+    def set_period(self, today: datetime.date) -> None:
+        """
+        Задает период анализа, периоды пакетного режима и, если файлы не заданы через -s, файлы с данными периода
+        :param today: текущая дата, по ней определяется период по умолчанию - текущий месяц
+        """
+
+        default_period = ReportPeriod.current_month(today)
+        self.period = ReportPeriod.from_dates(default_period.begin_date if self.args.begin_date is None else parse_date(self.args.begin_date),
+                                              default_period.end_date if self.args.end_date is None else parse_date(self.args.end_date))
+        self.begin_date = self.period.begin_date
+        self.end_date = self.period.end_date
+        self.process_year = self.period.process_year
+        self.begin_of_the_year = self.period.begin_of_the_year
+        self.end_of_the_year = self.period.end_of_the_year
+
+        # Пакетный режим: несколько периодов из одной загрузки данных
+        if self.args.periods is not None:
+            self.periods = list(self.args.periods)
+        elif self.args.every is not None:
+            self.periods = self.period.split(self.args.every)
+        else:
+            self.periods = [self.period]
+
+        if self.args.source_file is None:
+            # Для периода на стыке лет добавляется файл следующего года, если он уже выложен
+            self.urls = [self.default_source_file(year) for year in self.process_year]
+            self.urls = self.urls[:1] + [url for url in self.urls[1:] if url.is_file()]
+
+    def make_report_file(self, period: ReportPeriod) -> Path:
+        """
+        Имя файла отчета за период. В пакетном режиме к имени из --report-file добавляется период,
+        в режиме --split-clusters - кластер
+        :param period: период анализа
+        :return: путь к файлу отчета
+        """
+
+        if self.args.report_file is None:
+            if self.args.dont_save_ap:
+                report_file = Path(self.dir_name, f'{datetime.date.today().strftime("%Y%m%d")} Отчет по выполнению мероприятий КФ ({period.name}).xlsx')
+            else:
+                report_file = Path(self.dir_name, f'{datetime.date.today().strftime("%Y%m%d")} Отчет по выполнению мероприятий КФ ({period.name}) (АП).xlsx')
+        elif len(self.periods) > 1:
+            report_file = Path(self.args.report_file)
+            report_file = Path(report_file.parent, f'{report_file.stem} ({period.name}){report_file.suffix}')
+        else:
+            report_file = Path(self.args.report_file)
+        if self.cluster is not None:
+            report_file = Path(report_file.parent, f'{report_file.stem} ({self.cluster}){report_file.suffix}')
+        return report_file
+
+    @staticmethod
+    def default_source_file(year: int) -> Path:
+        """ Файл с данными на сетевом диске за год """
+        return Path(f'//megafon.ru/KVK/KRN/Files/TelegrafFiles/ОПРС/!Проекты РЦРП/Блок №3/{year} год/MDP_24_25.xlsb')
+
+    def check_data_age(self) -> bool:
+        """
+        Проверяет, что данные обновлялись не раньше 3 часов назад. Для нескольких файлов проверяется самый свежий из них:
+        файл прошлого года не обновляется. Для устаревших данных действует политика --stale-data
+        :return: True - продолжать обработку данных
+        """
+
+        try:
+            url, mtime = max(((source, os.stat(source).st_mtime) for source in self.urls), key=lambda item: item[1])
+        except FileNotFoundError as ex:
+            raise MyLoggingException(f'Файл с данными не существует. Ошибка {ex}')
+        data_update_age = datetime.datetime.now() - datetime.datetime.fromtimestamp(mtime)
+        if data_update_age <= datetime.timedelta(hours=3):
+            return True
+        message = f'Файл {url} обновлялся {(data_update_age.days * 24 + data_update_age.seconds / 3600):.2f} часов назад!'
+        if self.args.stale_data == 'ask':
+            return input(f'{Colors.RED}{message} Хотите продолжить обработку данных (y/N)?{Colors.END}').lower() == 'y'
+        if self.args.stale_data == 'continue':
+            print(f'{Colors.YELLOW}{message} Продолжаем обработку данных{Colors.END}')
+            return True
+        print(f'{Colors.RED}{message} Обработка данных прервана{Colors.END}')
+        return False
+
+    def get_data(self, check_age: bool = True) -> Union[pd.DataFrame, dict[str, pd.DataFrame]]:
+        """
+        Загружает листы файлов с данными. Несколько файлов читаются параллельно и объединяются в общие листы.
+        Неизмененный файл повторно не разбирается: данные берутся из памяти (режим --watch) или из кэша
+        :param check_age: проверить возраст данных (check_data_age) и завершить программу для устаревших данных
+        :return: словарь {имя листа: данные}
+        """
+
+        if check_age and not self.check_data_age():
+            sys.exit(12)
+        if self.args.stream:
+            return self.stream_data()
+        previous_sources = [self.sources.get(url) for url in self.urls]
+        if len(self.urls) == 1:
+            sources = [self.load_source(self.urls[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=len(self.urls)) as executor:
+                sources = list(executor.map(self.load_source, self.urls))
+        if self.data is not None and all(source is previous for source, previous in zip(sources, previous_sources)):
+            print('Содержимое файлов не изменилось, используются загруженные ранее данные')
+            return self.data
+        self.data = sources[0][1] if len(sources) == 1 else self.concat_sources([data for _, data in sources])
+        return self.data
+
+    def load_source(self, url: Path) -> tuple[str, dict[str, pd.DataFrame]]:
+        """
+        Загружает листы одного файла с данными
+        :param url: файл с данными
+        :return: хэш содержимого файла и словарь {имя листа: данные}
+        """
+
         try:
-            data_update_age = datetime.datetime.now() - datetime.datetime.fromtimestamp(os.stat(self.url).st_mtime)
-            if data_update_age > datetime.timedelta(hours=3):
-                if input(
-                        f'{Colors.RED}Файл {self.url} обновлялся {(data_update_age.days * 24 + data_update_age.seconds / 3600):.2f} часов назад! Хотите продолжить обработку данных (y/N)?{Colors.END}').lower() != 'y':
-                    sys.exit(12)
-            print(f'Получение данных из файла {Colors.GREEN}"{self.url}"{Colors.END}')
-            with open(self.url, 'rb') as f:
-                g = io.BytesIO(f.read())
-            _df = pd.read_excel(g, sheet_name=self.sheets, engine="calamine")
-            g.close()
+            local_file = self.local_source(url)
+            # Хэш считается по отображению файла в память, без копии содержимого в памяти процесса
+            with open(local_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                cache_key = self.cache.make_key(local_file, content)
+            if url in self.sources and self.sources[url][0] == cache_key['hash']:
+                return self.sources[url]
+            _df = None if self.args.no_cache else self.cache.load(cache_key)
+            if _df is not None:
+                print(f'Данные загружены из кэша {Colors.GREEN}"{self.cache.cache_dir}"{Colors.END}')
+            else:
+                # calamine читает локальный файл сам, отдельная копия файла в BytesIO не нужна
+                with pd.ExcelFile(local_file, engine="calamine") as excel_file:
+                    # Из листа 'Массив' читаются только колонки, которые используются в отчете
+                    _df = {sh_name: excel_file.parse(sh_name, usecols=self.use_source_column if sh_name == self.sheets[0] else None) for sh_name in self.sheets}
+                _df[self.sheets[0]] = self.prepare_data(_df[self.sheets[0]])
+                if not self.args.no_cache:
+                    self.cache.save(cache_key, _df)
+            self.sources[url] = (cache_key['hash'], _df)
+            return self.sources[url]
         except FileNotFoundError as ex:
-            raise MyLoggingException(f'Файл {self.url} не существует. Ошибка {ex}')
-        except XLRDError:
+            raise MyLoggingException(f'Файл {url} не существует. Ошибка {ex}')
+        except protected_file_errors():
             try:
-                print(f'Try read data from protected file: {Colors.GREEN}"{self.url}"{Colors.END}')
+                print(f'Try read data from protected file: {Colors.GREEN}"{url}"{Colors.END}')
                 _df = dict()
-                wb = xw.Book(self.url)
+                wb = self.open_xlwings_book(url)
                 for sh_name in self.sheets:
                     sheet = wb.sheets[wb.sheet_names.index(sh_name)]
-                    _df[sh_name] = pd.DataFrame(sheet['A1'].expand().options(pd.DataFrame, chunksize=1_000_000).value).reset_index()
-            except XLRDError as err:
-                print(f'{Colors.RED}XLRD Error: Ошибка открытия защищенного файла "{self.url}". {err}{Colors.END}')
+                    if sh_name == self.sheets[0]:
+                        _df[sh_name] = self.prepare_data(self.read_xlwings_columns(sheet))
+                    else:
+                        _df[sh_name] = pd.DataFrame(sheet['A1'].expand().options(pd.DataFrame, chunksize=1_000_000).value).reset_index()
+            except protected_file_errors() as err:
+                print(f'{Colors.RED}XLRD Error: Ошибка открытия защищенного файла "{url}". {err}{Colors.END}')
                 sys.exit(140)
             except ValueError as err:
                 if "Cannot open two workbooks named" in err.__str__():
                     print(
                         f'{Colors.RED}XLRD Error: Excel не может открыть 2 файла с одним именем, даже сохраненные в разных местах. Закройте окно Excel с файлом "'
-                        f'{self.url.name}".{Colors.END}')
+                        f'{url.name}".{Colors.END}')
                 else:
                     print(f'{Colors.RED}XLRD Error: {err}{Colors.END}')
                 sys.exit(140)
             except Exception as ex:
                 raise MyLoggingException(f'Ошибка при получении данных: {ex}')
+        return None, _df
+
+    def local_source(self, url: Path) -> Path:
+        """
+        Файл, из которого читаются данные: локальная копия (--mirror) или сам файл
+        :param url: файл с данными
+        :return: путь к файлу для чтения
+        """
+
+        if self.args.mirror == 'always' or self.args.mirror == 'auto' and self.mirror.is_network_path(url):
+            local_file = self.mirror.sync(url)
+        else:
+            local_file = Path(url)
+        print(f'Получение данных из файла {Colors.GREEN}"{local_file}"{Colors.END}')
+        return local_file
+
+    @staticmethod
+    def open_xlwings_book(url: Path):
+        """
+        Открывает защищенный файл в Excel через xlwings
+        :param url: файл с данными
+        :return: книга xlwings
+        """
+
+        # xlwings нужен только для защищенных файлов, его импорт занимает заметную часть запуска программы
+        import xlwings as xw
+        if threading.current_thread() is not threading.main_thread():
+            # Excel доступен из потока пула только после инициализации COM в этом потоке
+            import pythoncom
+            pythoncom.CoInitialize()
+        return xw.Book(url)
+
+    def stream_data(self) -> dict[str, pd.DataFrame]:
+        """
+        Потоковая загрузка (--stream): лист 'Массив' читается частями, каждая часть сразу сворачивается в накопительные
+        счетчики сводных таблиц (self.cube), а из строк части остаются только строки адресных планов периодов отчета.
+        Файлы читаются в обратном порядке: при совпадении ID_ESUP остаются строки файла, указанного позже
+        :return: словарь {имя листа: данные}, лист 'Массив' содержит только строки адресных планов
+        """
+
+        builder = DateCubeBuilder()
+        parts = []
+        other_sheets = {sh_name: [] for sh_name in self.sheets[1:]}
+        later_ids = np.array([])
+        total_rows = 0
+        for url in reversed(self.urls):
+            file_parts = []
+            file_ids = [later_ids]
+            for sh_name, part in self.stream_source(url):
+                if sh_name != self.sheets[0]:
+                    other_sheets[sh_name].insert(0, part)
+                    continue
+                part = self.prepare_data(part)
+                if 'ID_ESUP' in part.columns:
+                    part = part[~part['ID_ESUP'].isin(later_ids).to_numpy(dtype=bool)]
+                    file_ids.append(part['ID_ESUP'].dropna().to_numpy())
+                total_rows += len(part)
+                builder.add(part, self.make_event_streams(part), self.make_po_self_mask(part))
+                part = part[self.make_ap_mask(part)]
+                # Пустые части не участвуют в объединении, иначе типы колонок становятся object
+                if not part.empty or len(parts) + len(file_parts) == 0:
+                    file_parts.append(part)
+            later_ids = np.unique(np.concatenate(file_ids))
+            parts = file_parts + parts
+        with self.profiler.stage('make_cube', input_rows=total_rows) as record:
+            self.cube = builder.build()
+            record['groups'] = len(self.cube.groups)
+        _df = {self.sheets[0]: self.prepare_data(pd.concat(parts, ignore_index=True))}
+        for sh_name, sheet_parts in other_sheets.items():
+            _df[sh_name] = pd.concat(sheet_parts, ignore_index=True).drop_duplicates(ignore_index=True)
+        # Счетчики построены по всем строкам файлов, get_cube() не должен пересчитывать их по строкам адресных планов
+        self.cube.df = _df[self.sheets[0]]
+        print(f'Обработано строк: {Colors.GREEN}{total_rows}{Colors.END}, в памяти оставлено строк адресных планов: {Colors.GREEN}{len(_df[self.sheets[0]])}{Colors.END}')
+        self.data = _df
+        return self.data
+
+    def stream_source(self, url: Path) -> Iterator[tuple[str, pd.DataFrame]]:
+        """
+        Читает листы одного файла с данными: лист 'Массив' частями через SourceStream, остальные листы целиком
+        :param url: файл с данными
+        :return: пары (имя листа, данные или часть данных листа)
+        """
+
+        stream = SourceStream(self.use_source_column)
+        try:
+            local_file = self.local_source(url)
+            for part in stream.iter_calamine(local_file, self.sheets[0]):
+                yield self.sheets[0], part
+            for sh_name in self.sheets[1:]:
+                yield sh_name, pd.read_excel(local_file, sheet_name=sh_name, engine="calamine")
+        except FileNotFoundError as ex:
+            raise MyLoggingException(f'Файл {url} не существует. Ошибка {ex}')
+        except protected_file_errors():
+            print(f'Try read data from protected file: {Colors.GREEN}"{url}"{Colors.END}')
+            try:
+                wb = self.open_xlwings_book(url)
+                for sh_name in self.sheets:
+                    sheet = wb.sheets[wb.sheet_names.index(sh_name)]
+                    if sh_name == self.sheets[0]:
+                        for part in stream.iter_xlwings(sheet):
+                            yield sh_name, part
+                    else:
+                        yield sh_name, pd.DataFrame(sheet['A1'].expand().options(pd.DataFrame, chunksize=1_000_000).value).reset_index()
+            except Exception as ex:
+                raise MyLoggingException(f'Ошибка при получении данных: {ex}')
+
+    def make_ap_mask(self, _df: pd.DataFrame) -> np.ndarray:
+        """
+        Строки, которые попадают в адресный план хотя бы одного листа отчета за один из периодов отчета
+        :param _df: данные для анализа
+        :return: логическая маска строк
+        """
+
+        mask_ap = np.zeros(len(_df), dtype=bool)
+        if self.args.dont_save_ap:
+            return mask_ap
+        planner = ReportPlanner(_df)
+        for spec in SHEET_SPECS:
+            if spec.ap_sheet is not None and (self.args.experimental or not spec.experimental):
+                mask_ap[planner.rows(spec)] = True
+        mask_period = np.zeros(len(_df), dtype=bool)
+        for period in self.periods:
+            mask_period |= planner.date_mask('PROGNOZ_DATE', period.begin_date, period.end_date)
+        return mask_ap & mask_period
+
+    def concat_sources(self, sources: list[dict[str, pd.DataFrame]]) -> dict[str, pd.DataFrame]:
+        """
+        Объединяет листы нескольких файлов. Строки 'Массив' с ID_ESUP, который есть в файле, указанном позже, не включаются.
+        Типы колонок приводятся заново: категории разных файлов объединяются
+        :param sources: данные файлов в порядке файлов
+        :return: словарь {имя листа: данные}
+        """
+
+        parts = []
+        later_ids = np.array([])
+        for source in reversed(sources):
+            _df = source[self.sheets[0]]
+            if 'ID_ESUP' in _df.columns:
+                mask_replaced = _df['ID_ESUP'].isin(later_ids).to_numpy(dtype=bool)
+                if mask_replaced.any():
+                    logger.info(f'{mask_replaced.sum()} строк заменены строками из более позднего файла')
+                    _df = _df[~mask_replaced]
+                later_ids = np.union1d(later_ids, _df['ID_ESUP'].dropna().to_numpy())
+            # Пустой лист не участвует в объединении, иначе типы колонок становятся object
+            if not _df.empty or len(parts) == 0:
+                parts.append(_df)
+        _df = {self.sheets[0]: self.prepare_data(pd.concat(parts[::-1], ignore_index=True))}
+        for sh_name in self.sheets[1:]:
+            _df[sh_name] = pd.concat([source[sh_name] for source in sources if sh_name in source], ignore_index=True).drop_duplicates(ignore_index=True)
         return _df
 
+    def use_source_column(self, column_name) -> bool:
+        """
+        Проверка, нужна ли колонка листа 'Массив' для отчета
+        :param column_name: имя колонки
+        :return: True, если колонку нужно загружать
+        """
+
+        return column_name in self.source_columns
+
+    def read_xlwings_columns(self, sheet) -> pd.DataFrame:
+        """
+        Читает из листа Excel через xlwings только колонки, которые нужны для отчета
+        :param sheet: лист xlwings
+        :return: данные листа
+        """
+
+        table = sheet['A1'].expand()
+        header = sheet['A1'].expand('right').value
+        columns = {}
+        for number, column_name in enumerate(header, start=1):
+            if self.use_source_column(column_name):
+                columns[column_name] = sheet.range((2, number), (table.last_cell.row, number)).options(ndim=1, chunksize=1_000_000).value
+        return pd.DataFrame(columns)
+
+    def prepare_data(self, _df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Приводит колонки листа 'Массив' к заданным типам: даты, флаги и целые в малых целых, категории для повторяющихся строк.
+        Колонки, которые не используются в отчете, удаляются
+        :param _df: загруженные данные
+        :return: данные с заданными типами колонок
+        """
+
+        _df = _df[[column_name for column_name in _df.columns if self.use_source_column(column_name)]]
+        converted = {}
+        for column_name in _df.columns:
+            if column_name in self.date_columns:
+                converted[column_name] = pd.to_datetime(_df[column_name], errors='coerce')
+            elif column_name in self.flag_columns:
+                values = pd.to_numeric(_df[column_name], errors='coerce')
+                not_empty = values.dropna()
+                # Флаги хранятся в Int8, если все значения целые и помещаются в тип, иначе остаются числами
+                if ((not_empty % 1 == 0) & not_empty.between(-128, 127)).all():
+                    values = values.astype('Int8')
+                converted[column_name] = values
+            elif column_name in self.category_columns:
+                converted[column_name] = _df[column_name].astype('category')
+            elif column_name in self.integer_columns:
+                values = _df[column_name]
+                # Целые без пустых значений хранятся в наименьшем подходящем типе, остальные значения не меняются
+                if pd.api.types.is_numeric_dtype(values) and values.notna().all() and (values % 1 == 0).all():
+                    converted[column_name] = pd.to_numeric(values.astype('int64'), downcast='integer')
+        return _df.assign(**converted)
+
     @staticmethod
     def make_date_mask(_df: pd.DataFrame, column_name: str, _begin_date: datetime, _end_date: datetime) -> bool:
         """
@@ -164,18 +676,164 @@ class WeeklyReport:
         _result = (_df[column_name] >= _begin_date) & (_df[column_name] <= _end_date)
         return _result
 
-    def make_report(self, _df: pd.DataFrame, _dfo: pd.DataFrame = None, divide_prognosis: bool = False, add_spec: bool = False) -> pd.DataFrame:
+    def make_event_streams(self, _df: pd.DataFrame) -> dict[str, tuple[str, pd.Series]]:
+        """
+        Потоки событий, из которых складываются показатели сводного отчета (см. METRICS).
+        Не зависят от периода анализа
+        :param _df: данные для анализа
+        :return: словарь {имя потока: (колонка с датой события, признак строки)}
+        """
+
+        # Флаги в Int8 могут содержать пустые значения, они не считаются выполненными
+        mask_check_fact = (_df['CHECK_FACT'] == 1).fillna(False)
+        mask_check_vidacha = (_df['Выдача оборудования'] == 1).fillna(False)
+        # mask_check_vidacha = (_df['83_done'] == 1)
+        mask_48_complete = (_df['Комплект 48-х'] == 1).fillna(False)
+        mask_np = (_df['НП'] == 1).fillna(False)
+
+        # TODO: Временно до объединения программ 2024 и 2025
+        mask_exclude_done_2024 = _df['MIN_DATE_FACT'] < datetime.datetime(2025, 1, 1)
+
+        return {
+            'plan': ('PLAN_DATE_END', ~mask_exclude_done_2024),
+            'prognoz': ('PROGNOZ_DATE', ~mask_exclude_done_2024),
+            'fact': ('MIN_DATE_FACT', mask_check_fact),
+            'vidacha': ('PROGNOZ_DATE', mask_check_vidacha),
+            'spec48': ('PROGNOZ_DATE', mask_48_complete),
+            'np': ('PROGNOZ_DATE', mask_np),
+        }
+
+    @staticmethod
+    def make_po_self_mask(_df: pd.DataFrame) -> pd.Series:
+        """ Признак работ своими силами """
+        return _df['PO'] == 'Работы своими силами'
+
+    @staticmethod
+    def make_windows(period: ReportPeriod) -> dict[str, tuple[datetime.datetime, datetime.datetime]]:
+        """
+        Окна дат показателей для периода анализа
+        :param period: период анализа
+        :return: словарь {имя окна: (начало, окончание)}, границы входят в окно
+        """
+
+        return {
+            'ytd': (period.begin_of_the_year, period.end_date),
+            'period': (period.begin_date, period.end_date),
+            'forward': (period.end_date + datetime.timedelta(seconds=2), period.end_of_the_year),
+        }
+
+    def make_indicators(self, _df: pd.DataFrame, period: ReportPeriod = None) -> pd.DataFrame:
+        """
+        Формирует признаки (0/1) попадания каждой строки исходных данных в показатели сводного отчета
+        :param _df: данные для анализа
+        :param period: период анализа. None - период из параметров запуска
+        :return: возвращает таблицу с колонками RO_CLUSTER, RO и по одной колонке на каждый показатель
+        """
+
+        if period is None:
+            period = self.period
+
+        streams = self.make_event_streams(_df)
+        windows = self.make_windows(period)
+        mask_po_self_do = self.make_po_self_mask(_df)
+
+        # Маска каждой пары (колонка с датой, окно) вычисляется один раз
+        date_masks = {}
+        indicators = {}
+        for name, metric in METRICS.items():
+            date_column, mask_stream = streams[metric.stream]
+            if (date_column, metric.window) not in date_masks:
+                date_masks[date_column, metric.window] = self.make_date_mask(_df, date_column, *windows[metric.window])
+            _mask = date_masks[date_column, metric.window] & mask_stream
+            if metric.po_self is not None:
+                _mask = _mask & (mask_po_self_do if metric.po_self else ~mask_po_self_do)
+            indicators[name] = _mask
+
+        logger.debug(_df[date_masks['PROGNOZ_DATE', 'period']])
+        return pd.DataFrame({'RO_CLUSTER': _df['RO_CLUSTER'], 'RO': _df['RO'], **{name: mask.astype('int8') for name, mask in indicators.items()}})
+
+    @staticmethod
+    def report_metrics(divide_prognosis: bool = False, add_spec: bool = False) -> list[str]:
+        """
+        Показатели сводного отчета в порядке колонок итоговой таблицы
+        :param divide_prognosis: разделить прогноз на работы ПО и работы своими силами
+        :param add_spec: добавить комплекты 48-х и НП
+        :return: список показателей (ключи METRICS)
+        """
+
+        metrics = ['PLAN_DATE_END', 'CUMM_PROGNOZ_DATE']
+        if add_spec:
+            metrics += ['Комплект 48-х', 'НП']
+        metrics += ['Выдача оборудования', 'FORWARD_VIDACHA', 'CHECK_FACT']
+        if divide_prognosis:
+            metrics += ['PROGNOZ_DATE_PO', 'PROGNOZ_DATE_SELF']
+        else:
+            metrics += ['PROGNOZ_DATE']
+        return metrics
+
+    def make_report(self, _df: pd.DataFrame, _dfo: pd.DataFrame = None, divide_prognosis: bool = False, add_spec: bool = False,
+                    rows: np.ndarray = None, indicators: pd.DataFrame = None, period: ReportPeriod = None) -> pd.DataFrame:
         """
         Собирает сводный отчет из исходных данных
         :param _df: данные для анализа
         :param _dfo: данные по обязательствам
         :param divide_prognosis: признак (False/True), который позволяет разделить данные прогноза на работы ПО и работы своими силами
         :param add_spec: позволяет добавить в таблицу данные по комплектам 48 заявок и подаче в НП
+        :param rows: позиции строк _df, по которым строится отчет. None - все строки
+        :param indicators: заранее вычисленный make_indicators(_df), чтобы не пересчитывать его для каждого листа
+        :param period: период анализа. None - период из параметров запуска
+        :return: возвращает сформированную сводную таблицу
+        """
+
+        metrics = self.report_metrics(divide_prognosis, add_spec)
+        if indicators is None:
+            indicators = self.make_indicators(_df, period)
+        if rows is not None:
+            indicators = indicators.take(rows)
+
+        # Все показатели считаются за один проход groupby().sum() по признакам 0/1
+        return self.format_report(indicators.groupby(['RO_CLUSTER', 'RO'], sort=True, observed=True)[metrics].sum())
+
+    def make_cube_report(self, cube: DateCube, spec: SheetSpec, period: ReportPeriod = None, cluster: str = None) -> pd.DataFrame:
+        """
+        Собирает сводный отчет листа по накопительным счетчикам DateCube, без прохода по исходным данным.
+        Результат совпадает с make_report() по строкам листа
+        :param cube: счетчики событий, построенные get_cube()
+        :param spec: описание листа
+        :param period: период анализа. None - период из параметров запуска
+        :param cluster: только регионы кластера RO_CLUSTER. None - все кластеры
         :return: возвращает сформированную сводную таблицу
         """
 
+        if period is None:
+            period = self.period
+
+        metrics = self.report_metrics(spec.divide_prognosis, spec.add_spec)
+        windows = self.make_windows(period)
+        groups = cube.planner.rows(spec)
+        if cluster is not None:
+            groups = groups[cube.planner.mask('RO_CLUSTER', (cluster,))[groups]]
+        po_self = cube.groups['PO_SELF'].to_numpy(dtype=bool)[groups]
+        counts = {}
+        for name in metrics:
+            metric = METRICS[name]
+            values = cube.count(metric.stream, *windows[metric.window], groups=groups)
+            if metric.po_self is not None:
+                values = values * (po_self == metric.po_self)
+            counts[name] = values
+        df_counts = pd.DataFrame({'RO_CLUSTER': cube.groups['RO_CLUSTER'].take(groups).to_numpy(),
+                                  'RO': cube.groups['RO'].take(groups).to_numpy(), **counts})
+        return self.format_report(df_counts.groupby(['RO_CLUSTER', 'RO'], sort=True, observed=True)[metrics].sum())
+
+    @staticmethod
+    def format_report(df_merged: pd.DataFrame) -> pd.DataFrame:
+        """
+        Оформляет сводную таблицу: убирает пустые регионы, переименовывает колонки, добавляет Δ и строку ИТОГО:
+        :param df_merged: количество по показателям, индекс (RO_CLUSTER, RO), колонки в порядке report_metrics()
+        :return: сводная таблица для листа отчета
+        """
+
         delta_char = f'{chr(0x0394)}'
-        _df[['PROGNOZ_DATE', 'PLAN_DATE_END']].apply(pd.to_datetime)
 
         rename_columns = {
             'RO_CLUSTER': 'Кластер',
@@ -193,316 +851,526 @@ class WeeklyReport:
             'НП': 'НП',
 
         }
-        mask_cumm_plan_date = self.make_date_mask(_df, 'PLAN_DATE_END', self.begin_of_the_year, self.end_date)
-        mask_cumm_prognoz_date = self.make_date_mask(_df, 'PROGNOZ_DATE', self.begin_of_the_year, self.end_date)
-        mask_prognoz_date = self.make_date_mask(_df, 'PROGNOZ_DATE', self.begin_date, self.end_date)
-        mask_fact_date = self.make_date_mask(_df, 'MIN_DATE_FACT', self.begin_of_the_year, self.end_date)
-        # mask_vidacha_date = self.make_date_mask(_df, 'PROGNOZ_DATE', self.begin_of_the_year, self.end_of_the_year)
-        mask_vidacha_date = self.make_date_mask(_df, 'PROGNOZ_DATE', self.begin_of_the_year, self.end_date)
-        mask_vidacha_date_forward = self.make_date_mask(_df, 'PROGNOZ_DATE', self.end_date + datetime.timedelta(seconds=2), self.end_of_the_year)
-        mask_check_fact = (_df['CHECK_FACT'] == 1)
-        mask_check_plan = (_df['CHECK_PLAN'] == "Да")
-        mask_check_vidacha = (_df['Выдача оборудования'] == 1)
-        # mask_check_vidacha = (_df['83_done'] == 1)
-        mask_48_complete = (_df['Комплект 48-х'] == 1)
-        mask_48_complete_date = self.make_date_mask(_df, 'PROGNOZ_DATE', self.begin_of_the_year, self.end_date)
-        mask_np = (_df['НП'] == 1)
-        mask_np_date = self.make_date_mask(_df, 'PROGNOZ_DATE', self.begin_of_the_year, self.end_date)
 
-        # TODO: Временно до объединения программ 2024 и 2025
-        mask_exclude_done_2024 = _df['MIN_DATE_FACT'] < datetime.datetime(2025, 1, 1)
+        metrics = list(df_merged.columns)
+        # Регион попадает в отчет, только если у него есть хотя бы один ненулевой показатель
+        df_merged = df_merged[df_merged.any(axis=1)].reset_index()
+        df_merged = df_merged.astype({'RO_CLUSTER': str, 'RO': str}).sort_values(by='RO').rename(columns=rename_columns)
 
-        # TODO:
-        mask_include_2025_done = _df['MIN_DATE_FACT'] >= datetime.datetime(2025, 1, 1)
-        mask_addition = (mask_include_2025_done & mask_check_plan & mask_check_fact)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=FutureWarning)
+            # Добавляем подсчет суммы в строку ИТОГО:
+            df_merged[delta_char] = df_merged[rename_columns['CHECK_FACT']] - df_merged[rename_columns['PLAN_DATE_END']]
+            df_merged.loc["total"] = df_merged.sum(numeric_only=True)
+            df_merged.at["total", 'Регион'] = "ИТОГО:"
 
-        logger.debug(_df[mask_prognoz_date])
-        # df_cumm_plan = _df[(mask_cumm_plan_date | mask_addition) & ~mask_exclude_done_2024].groupby(['RO_CLUSTER', 'RO']).agg({'PLAN_DATE_END': 'count',}).reset_index()
-        df_cumm_plan = _df[mask_cumm_plan_date & ~mask_exclude_done_2024].groupby(['RO_CLUSTER', 'RO']).agg({'PLAN_DATE_END': 'count', }).reset_index()
-        df_cumm_prognoz = _df[mask_cumm_prognoz_date & ~mask_exclude_done_2024].groupby(['RO_CLUSTER', 'RO']).agg({'PROGNOZ_DATE': 'count', }).rename(columns={'PROGNOZ_DATE': 'CUMM_PROGNOZ_DATE'}).reset_index()
-        if divide_prognosis:
-            mask_po_self_do = _df['PO'] == 'Работы своими силами'
-            df_prognoz_po = _df[mask_prognoz_date & ~mask_po_self_do & ~mask_exclude_done_2024].groupby(
-                ['RO_CLUSTER', 'RO']).agg(
-                {'PROGNOZ_DATE': 'count', }).rename(
-                columns={'PROGNOZ_DATE': 'PROGNOZ_DATE_PO'}).reset_index()
-            df_prognoz_self_do = _df[mask_prognoz_date & mask_po_self_do & ~mask_exclude_done_2024].groupby(
-                ['RO_CLUSTER', 'RO']).agg(
-                {'PROGNOZ_DATE': 'count', }).rename(
-                columns={'PROGNOZ_DATE': 'PROGNOZ_DATE_SELF'}).reset_index()
-        else:
-            df_prognoz = _df[mask_prognoz_date & ~mask_exclude_done_2024].groupby(['RO_CLUSTER', 'RO']).agg({'PROGNOZ_DATE': 'count', }).reset_index()
+        # Удаляем кластеры из итоговой таблицы
+        return df_merged[[rename_columns['RO']] + [rename_columns[metric] for metric in metrics] + [delta_char]]
 
-        df_fact = _df[mask_fact_date & mask_check_fact].groupby(['RO_CLUSTER', 'RO']).agg({'CHECK_FACT': 'count', }).reset_index()
-        df_vidacha = _df[mask_vidacha_date & mask_check_vidacha].groupby(['RO_CLUSTER', 'RO']).agg({'Выдача оборудования': 'count', }).reset_index()
-        df_vidacha_forward = _df[mask_vidacha_date_forward & mask_check_vidacha].groupby(['RO_CLUSTER', 'RO']).agg({'Выдача оборудования': 'count', }).rename(
-            columns={'Выдача оборудования': 'FORWARD_VIDACHA'}).reset_index()
+    def make_workbook(self) -> Union['FormattedWorkbook', 'StreamingWorkbook']:
+        """
+        Создает книгу отчета с выбранной библиотекой записи
+        :return: книга с методом excel_format_table
+        """
 
-        df_48_complete = _df[mask_48_complete_date & mask_48_complete].groupby(['RO_CLUSTER', 'RO']).agg({'Комплект 48-х': 'count', }).reset_index()
-        df_np = _df[mask_np_date & mask_np].groupby(['RO_CLUSTER', 'RO']).agg({'НП': 'count', }).reset_index()
+        # Библиотеки записи импортируются только при формировании книги
+        if self.args.writer == 'xlsxwriter':
+            from StreamingWorkbook import StreamingWorkbook
+            return StreamingWorkbook(logging_level=self.log_level)
+        from FormattedWorkbook import FormattedWorkbook
+        return FormattedWorkbook(logging_level=self.log_level)
 
-        # Список данных для объединения
-        if divide_prognosis:
-            if add_spec:
-                data_frames = [df_cumm_plan, df_cumm_prognoz, df_fact, df_vidacha, df_vidacha_forward, df_prognoz_po, df_prognoz_self_do, df_48_complete, df_np]
-            else:
-                data_frames = [df_cumm_plan, df_cumm_prognoz, df_fact, df_vidacha, df_vidacha_forward, df_prognoz_po, df_prognoz_self_do]
-        else:
-            if add_spec:
-                data_frames = [df_cumm_plan, df_cumm_prognoz, df_fact, df_vidacha, df_vidacha_forward, df_prognoz, df_48_complete, df_np]
-            else:
-                data_frames = [df_cumm_plan, df_cumm_prognoz, df_fact, df_vidacha, df_vidacha_forward, df_prognoz]
+    def make_ap(self, _df: pd.DataFrame, rows: np.ndarray) -> pd.DataFrame:
+        """
+        Формирует адресный план
+        :param _df: исходные данные
+        :param rows: позиции строк _df, попадающих в адресный план, в порядке региональных отделений (ap_rows)
+        :return: возвращает адресный план, отсортированный по региональным отделениям
+        """
 
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", category=FutureWarning)
-            # Объединение с .merge и использование functools.reduce
-            df_merged = reduce(lambda left, right: pd.merge(left, right, how='outer', sort=True, on=['RO_CLUSTER', 'RO']), data_frames).fillna(value=0).sort_values(by='RO').rename(
-                columns=rename_columns)
+        _df = _df.iloc[rows][self.report_columns]
+        # Флаги Int8 выводятся так же, как они читаются из Excel: целыми числами, а при наличии пустых значений - float
+        _df = _df.astype({column_name: 'float64' if _df[column_name].hasnans else 'int64'
+                          for column_name in self.flag_columns if isinstance(_df[column_name].dtype, pd.Int8Dtype)})
+        return _df.rename(columns=self.ap_rename_columns)
 
-            # Еще один вариант с .merge "в лоб"
-            # df_merged = pd.merge(df_cumm_plan,
-            #                pd.merge(df_prognoz, pd.merge(df_vidacha, df_fact, how='outer', sort=True, on=['RO_CLUSTER', 'RO']), how='outer', sort=True, on=['RO_CLUSTER', 'RO']),
-            #                how='outer', sort=True, on=['RO_CLUSTER', 'RO']).fillna(value=0).sort_values(by='RO').rename(columns=rename_columns)
+    def ap_rows(self, df_kpi: pd.DataFrame, spec: SheetSpec, period: ReportPeriod = None, cluster: str = None) -> np.ndarray:
+        """
+        Позиции строк адресного плана листа: строки листа с прогнозом в периоде анализа.
+        Окно периода выбирается по индексу дат планировщика, который переиспользуется всеми периодами пакетного режима
+        :param df_kpi: исходные данные
+        :param spec: описание листа
+        :param period: период анализа. None - период из параметров запуска
+        :param cluster: только строки кластера RO_CLUSTER. None - все кластеры
+        :return: массив позиций строк в порядке региональных отделений
+        """
 
-            # Объединение с .join
-            # data_frames = [data_frame.set_index(['RO_CLUSTER', 'RO']) for data_frame in data_frames]
-            # df_merged = data_frames[0].join(data_frames[1:], how='outer', sort=True).reset_index().fillna(value=0).sort_values(by='RO').rename(columns=rename_columns)
+        if period is None:
+            period = self.period
 
-            # Добавляем подсчет суммы в строку ИТОГО:
-            df_merged[delta_char] = df_merged[rename_columns['CHECK_FACT']] - df_merged[rename_columns['PLAN_DATE_END']]
-            df_merged.loc["total"] = df_merged.sum(numeric_only=True)
-            df_merged.at["total", 'Регион'] = "ИТОГО:"
+        planner = self.get_planner(df_kpi)
+        rows = planner.window_rows(spec, 'PROGNOZ_DATE', period.begin_date, period.end_date)
+        if cluster is not None:
+            rows = rows[planner.mask('RO_CLUSTER', (cluster,))[rows]]
+        return rows
 
-            # Удаляем кластеры из итоговой таблицы
-            if divide_prognosis:
-                if add_spec:
-                    df_merged = df_merged[[rename_columns['RO'],
-                                           rename_columns['PLAN_DATE_END'],
-                                           rename_columns['CUMM_PROGNOZ_DATE'],
-                                           rename_columns['Комплект 48-х'],
-                                           rename_columns['НП'],
-                                           rename_columns['Выдача оборудования'],
-                                           rename_columns['FORWARD_VIDACHA'],
-                                           rename_columns['CHECK_FACT'],
-                                           rename_columns['PROGNOZ_DATE_PO'],
-                                           rename_columns['PROGNOZ_DATE_SELF'],
-                                           delta_char]]
-                else:
-                    df_merged = df_merged[[rename_columns['RO'],
-                                           rename_columns['PLAN_DATE_END'],
-                                           rename_columns['CUMM_PROGNOZ_DATE'],
-                                           rename_columns['Выдача оборудования'],
-                                           rename_columns['FORWARD_VIDACHA'],
-                                           rename_columns['CHECK_FACT'],
-                                           rename_columns['PROGNOZ_DATE_PO'],
-                                           rename_columns['PROGNOZ_DATE_SELF'],
-                                           delta_char]]
-            else:
-                if add_spec:
-                    df_merged = df_merged[[rename_columns['RO'],
-                                           rename_columns['PLAN_DATE_END'],
-                                           rename_columns['CUMM_PROGNOZ_DATE'],
-                                           rename_columns['Комплект 48-х'],
-                                           rename_columns['НП'],
-                                           rename_columns['Выдача оборудования'],
-                                           rename_columns['FORWARD_VIDACHA'],
-                                           rename_columns['CHECK_FACT'],
-                                           rename_columns['PROGNOZ_DATE'],
-                                           delta_char]]
-                else:
-                    df_merged = df_merged[[rename_columns['RO'],
-                                           rename_columns['PLAN_DATE_END'],
-                                           rename_columns['CUMM_PROGNOZ_DATE'],
-                                           rename_columns['Выдача оборудования'],
-                                           rename_columns['FORWARD_VIDACHA'],
-                                           rename_columns['CHECK_FACT'],
-                                           rename_columns['PROGNOZ_DATE'],
-                                           delta_char]]
-        return df_merged
-
-    def report_kpi(self, df_kpi: pd.DataFrame) -> FormattedWorkbook:
-        report_sheets = {
-            'Всего БС': 'all_bs_report',
-            'Новые БС': 'new_bs_report',
-            'Существующие БС': 'exist_bs_report',
-            'РРЛ': 'rrl_report',
-            'Энерго': 'energy_report',
-            'Энерго ПО строительства': 'energy_report_po',
-            'Энерго ПО ПЭ': 'energy_report_self_do',
-            'Климатика': 'climate_report',
-            'Климатика ПО строительства': 'climate_report_po',
-            'Климатика ПО ПЭ': 'climate_report_self_do',
-            'АП БС': 'ap_all_bs',
-            'АП РРЛ': 'ap_rrl',
-            'АП Энерго': 'ap_energy',
-            'АП Климатика': 'ap_climate',
-            'Дата выгрузки данных': 'upload_date',
-            'IPBH': 'ipbh_report',
-            'ВОЛС': 'vols_report',
-            'АП IPBH': 'ap_ipbh',
-            'АП ВОЛС': 'ap_vols',
-            'АКБ': 'akb_report',
-        }
+    def get_planner(self, df_kpi: pd.DataFrame) -> ReportPlanner:
+        """
+        Планировщик выборок для исходных данных. Для одних и тех же данных переиспользуется,
+        чтобы маски отбора не пересчитывались для каждого периода в пакетном режиме
+        :param df_kpi: исходные данные
+        :return: планировщик выборок
+        """
 
-        wb = FormattedWorkbook(logging_level=self.log_level)
+        if self.planner is None or self.planner.df is not df_kpi:
+            self.planner = ReportPlanner(df_kpi)
+        return self.planner
 
-        if not self.upload_date.empty:
-            name_of_upload = 'Дата выгрузки данных'
-            self.upload_date = self.upload_date.rename(columns={'DATE_UPLOAD': name_of_upload})
-            print(f'Создаем лист отчета: {Colors.GREEN}"{name_of_upload}"{Colors.END}')
-            wb.excel_format_table(self.upload_date, name_of_upload, report_sheets[name_of_upload])
+    def get_cube(self, df_kpi: pd.DataFrame) -> DateCube:
+        """
+        Накопительные счетчики дат для исходных данных. Строятся один раз на загрузку и используются для всех периодов
+        :param df_kpi: исходные данные
+        :return: счетчики событий
+        """
 
-        rename_columns = {
-            'ID_ESUP': 'ЕСУП ID',
-            'SAP_EVT': 'SAP EVT',
-            'BP_ESUP': 'Бизнес процесс',
-            'RO': 'Региональное отделение',
-            'CHECK_NEW_PLAN': 'Новая/Существующая',
-            'NAZ': 'Наименование',
-            'PLAN_DATE_END': 'Плановая дата',
-            'PROGNOZ_DATE': 'Прогнозная дата',
-            'PROGNOZ_COMMENT': 'Комментарий к прогнозной дате',
-            'RS_2023': 'RAN Sharing 2023',
-            'MIN_DATE_FACT': 'Мин. дата запуска',
-            'MAX_DATE_FACT': 'Макс. дата запуска',
-            'PROGRAM': 'Программа',
-            'CHECK_FACT': 'Факт запуска',
-            'RO_CLUSTER': 'Кластер',
-            'build_priority': 'Приоритет',
-            'Выдача оборудования': 'Выдача оборудования',
-            '83_done': 'Выдача по 83',
-        }
+        if self.cube is None or self.cube.df is not df_kpi:
+            with self.profiler.stage('make_cube', input_rows=len(df_kpi)) as record:
+                if self.args.incremental:
+                    self.cube = self.update_cube(df_kpi)
+                else:
+                    self.cube = DateCube.from_frame(df_kpi, self.make_event_streams(df_kpi), self.make_po_self_mask(df_kpi))
+                record['groups'] = len(self.cube.groups)
+        return self.cube
 
-        report_columns = [
-            'ID_ESUP',
-            'BP_ESUP',
-            'PROGRAM',
-            'CHECK_PLAN',
-            'CHECK_FACT',
-            'RO',
-            'RO_CLUSTER',
-            'NAZ',
-            'CHECK_NEW_PLAN',
-            'PO',
-            'PLAN_DATE_END',
-            'PROGNOZ_DATE',
-            'PROGNOZ_COMMENT',
-            'MIN_DATE_FACT',
-            'Выдача оборудования',
-            'Комплект 48-х',
-            'НП',
-        ]
+    def update_cube(self, df_kpi: pd.DataFrame) -> DateCube:
+        """
+        Накопительные счетчики дат из счетчиков предыдущей загрузки (--incremental): вычитаются удаленные и измененные строки
+        предыдущей загрузки, добавляются новые и измененные строки. Строки сопоставляются по ID_ESUP и хэшу строки.
+        Без предыдущей загрузки или при пустых и повторяющихся ID_ESUP счетчики строятся по всем строкам.
+        Различия загрузок сохраняются в self.changes для листа 'Изменения'
+        :param df_kpi: исходные данные
+        :return: счетчики событий
+        """
 
-        mask_rrl_build = df_kpi['BP_ESUP'] == 'Строительство РРЛ'
-        mask_rrl_rec = df_kpi['BP_ESUP'] == 'Переоборудование РРЛ'
-        mask_bs_build = df_kpi['BP_ESUP'] == 'Строительство БС/АМС'
-        mask_bs_rec = df_kpi['BP_ESUP'] == 'Переоборудование БС'
-        mask_bs_rs_on = df_kpi['BP_ESUP'] == 'БС_Включение RAN Sharing'
-        mask_energo = df_kpi['BP_ESUP'] == 'Модернизация энергоснабжения'
-        mask_climate = df_kpi['BP_ESUP'] == 'Модернизация климатического оборудования'
-        mask_ipbh = df_kpi['BP_ESUP'] == 'Ввод/модернизация/демонтаж элемента ТС - IPBH'
-        mask_vols = df_kpi['BP_ESUP'] == 'Строительство ВОЛС (городская)'
-        mask_akb = ((df_kpi['BP_ESUP'] == 'Модернизация энергоснабжения') & (df_kpi['PROGRAM'] == 'КФ. Base Case Эксплуатации – АКБ Волна 1. 2025'))
-
-        mask_po_self_do = df_kpi['PO'] == 'Работы своими силами'
-
-        # Убрал, в связи с изменение методики KPI в 2024 году
-        # mask_bs_pico = df_kpi['BP_ESUP'] == 'Pico Cell_Включение'
-        # mask_bs_dem = df_kpi['BP_ESUP'] == 'Демонтаж БС/АМС'
-
-        if self.process_year.__len__() == 2:
-            mask_plan_year = (df_kpi['PLAN_YEAR'] == self.process_year[0]) | (df_kpi['PLAN_YEAR'] == self.process_year[1])
+        rows = df_kpi.assign(**{ChangeTracker.HASH_COLUMN: ChangeTracker.row_hashes(df_kpi)})
+        previous = self.tracker.load(list(df_kpi.columns))
+        changes = None if previous is None else ChangeTracker.diff(previous[0], rows)
+        if changes is None:
+            print(f'{Colors.YELLOW}Предыдущая загрузка для сравнения не найдена, счетчики строятся по всем строкам{Colors.END}')
+            builder = DateCubeBuilder()
+            builder.add(df_kpi, self.make_event_streams(df_kpi), self.make_po_self_mask(df_kpi))
+            self.changes = None
         else:
-            mask_plan_year = df_kpi['PLAN_YEAR'] == self.process_year[0]
+            previous_rows, previous_counts = previous
+            print(f'Изменения с предыдущей загрузки: добавлено {Colors.GREEN}{len(changes.added)}{Colors.END}, '
+                  f'удалено {Colors.GREEN}{len(changes.removed)}{Colors.END}, изменено {Colors.GREEN}{len(changes.changed)}{Colors.END} строк')
+            builder = DateCubeBuilder(previous_counts)
+            removed = previous_rows.iloc[np.concatenate([changes.removed, changes.changed_previous])]
+            added = df_kpi.iloc[np.concatenate([changes.added, changes.changed])]
+            builder.add(removed, self.make_event_streams(removed), self.make_po_self_mask(removed), sign=-1)
+            builder.add(added, self.make_event_streams(added), self.make_po_self_mask(added))
+            self.changes = self.make_changes(previous_rows, df_kpi, changes)
+        self.tracker.save(rows, builder.counts())
+        cube = builder.build()
+        cube.df = df_kpi
+        return cube
 
-        mask_new_bs = df_kpi['CHECK_NEW_PLAN'] == 'Новая'
-        # mask_check_plan = (df_kpi['CHECK_PLAN'] == 'Да') | (df_kpi['CHECK_FACT'] == 1)
-        mask_check_plan = (df_kpi['CHECK_PLAN'] == 'Да')
+    def make_changes(self, previous: pd.DataFrame, current: pd.DataFrame, changes: RowChanges) -> pd.DataFrame:
+        """
+        Формирует лист 'Изменения': добавленные, удаленные и измененные строки с перечнем измененных колонок
+        :param previous: строки предыдущей загрузки
+        :param current: строки новой загрузки
+        :param changes: различия загрузок
+        :return: данные листа
+        """
 
-        # mask_2024_2023_boost = df_kpi['PROGRAM'] == "КФ. Развитие регионов_Ускоренные запуски 2024. 2023"
-        # mask_check_plan = mask_check_plan | mask_2024_2023_boost
+        columns = ['ID_ESUP', 'BP_ESUP', 'RO', 'NAZ']
+        compared = {column_name: self.ap_rename_columns.get(column_name, column_name) for column_name in current.columns}
+        changed_columns = ChangeTracker.changed_columns(previous.iloc[changes.changed_previous], current.iloc[changes.changed], compared)
+        parts = [
+            current.iloc[changes.added][columns].astype(object).assign(CHANGE='Добавлена', CHANGED_COLUMNS=''),
+            previous.iloc[changes.removed][columns].astype(object).assign(CHANGE='Удалена', CHANGED_COLUMNS=''),
+            current.iloc[changes.changed][columns].astype(object).assign(CHANGE='Изменена', CHANGED_COLUMNS=changed_columns),
+        ]
+        return (pd.concat(parts, ignore_index=True)
+                .rename(columns={**self.ap_rename_columns, 'CHANGE': 'Изменение', 'CHANGED_COLUMNS': 'Измененные колонки'}))
+
+    def get_engine(self, df_kpi: pd.DataFrame) -> PolarsEngine:
+        """
+        Данные в polars для --engine polars. Создаются один раз на загрузку и используются для всех периодов
+        :param df_kpi: исходные данные
+        :return: расчет сводных таблиц на polars
+        """
 
-        # df_all_bs = df_kpi[mask_check_plan & (mask_bs_build | mask_bs_rec | mask_bs_rs_on) & mask_plan_year][report_columns]
-        df_all_bs = df_kpi[mask_check_plan & (mask_bs_build | mask_bs_rec | mask_bs_rs_on)][report_columns]
-        print(f'Создаем лист отчета: {Colors.GREEN}"Всего БС"{Colors.END}')
-        wb.excel_format_table(self.make_report(df_all_bs), 'Всего БС', report_sheets['Всего БС'])
+        if self.engine is None or self.engine.df is not df_kpi:
+            with self.profiler.stage('make_polars_frame', input_rows=len(df_kpi)) as record:
+                self.engine = PolarsEngine(df_kpi, self.make_event_streams(df_kpi), self.make_po_self_mask(df_kpi))
+                record['rows'] = len(self.engine.frame)
+        return self.engine
 
-        # df_new_bs = df_kpi[mask_check_plan & (mask_bs_build | mask_bs_rec | mask_bs_rs_on) & mask_new_bs & mask_plan_year][report_columns]
-        df_new_bs = df_kpi[mask_check_plan & (mask_bs_build | mask_bs_rec | mask_bs_rs_on) & mask_new_bs][report_columns]
-        print(f'Создаем лист отчета: {Colors.GREEN}"Новые БС"{Colors.END}')
-        wb.excel_format_table(self.make_report(df_new_bs), 'Новые БС', report_sheets['Новые БС'])
+    def make_polars_reports(self, df_kpi: pd.DataFrame, sheet_specs: list[SheetSpec], period: ReportPeriod = None) -> list[pd.DataFrame]:
+        """
+        Собирает сводные отчеты листов на polars. Результат совпадает с make_report() по строкам каждого листа
+        :param df_kpi: исходные данные
+        :param sheet_specs: описания листов
+        :param period: период анализа. None - период из параметров запуска
+        :return: сводные таблицы в порядке sheet_specs
+        """
 
-        # df_exist_bs = df_kpi[mask_check_plan & (mask_bs_build | mask_bs_rec | mask_bs_rs_on) & ~mask_new_bs & mask_plan_year][report_columns]
-        df_exist_bs = df_kpi[mask_check_plan & (mask_bs_build | mask_bs_rec | mask_bs_rs_on) & ~mask_new_bs][report_columns]
-        print(f'Создаем лист отчета: {Colors.GREEN}"Существующие БС"{Colors.END}')
-        wb.excel_format_table(self.make_report(df_exist_bs), 'Существующие БС', report_sheets['Существующие БС'])
+        if period is None:
+            period = self.period
 
-        df_rrl = df_kpi[mask_check_plan & (mask_rrl_build | mask_rrl_rec)][report_columns]
-        print(f'Создаем лист отчета: {Colors.GREEN}"РРЛ"{Colors.END}')
-        wb.excel_format_table(self.make_report(df_rrl), 'РРЛ', report_sheets['РРЛ'])
+        engine = self.get_engine(df_kpi)
+        sheets = [(spec, self.report_metrics(spec.divide_prognosis, spec.add_spec)) for spec in sheet_specs]
+        return [self.format_report(counts) for counts in engine.report_counts(sheets, self.make_windows(period))]
 
-        df_energy = df_kpi[mask_check_plan & mask_energo][report_columns]
-        print(f'Создаем лист отчета: {Colors.GREEN}"Энерго"{Colors.END}')
-        wb.excel_format_table(self.make_report(df_energy, divide_prognosis=False), 'Энерго', report_sheets['Энерго'])
+    def make_sheets(self, df_kpi: pd.DataFrame, period: ReportPeriod = None) -> list[tuple[str, pd.DataFrame]]:
+        """
+        Рассчитывает данные всех листов отчета без записи в книгу.
+        С ключом --jobs листы рассчитываются параллельно в пуле потоков
+        :param df_kpi: исходные данные
+        :param period: период анализа. None - период из параметров запуска
+        :return: возвращает список (имя листа, данные) в порядке листов отчета
+        """
 
-        df_climate = df_kpi[mask_check_plan & mask_climate][report_columns]
-        print(f'Создаем лист отчета: {Colors.GREEN}"Климатика"{Colors.END}')
-        wb.excel_format_table(self.make_report(df_climate, divide_prognosis=False), 'Климатика', report_sheets['Климатика'])
+        if period is None:
+            period = self.period
 
-        if self.args.experimental:
-            df_ipbh = df_kpi[mask_check_plan & mask_ipbh][report_columns]
-            print(f'Создаем лист отчета: {Colors.GREEN}"IPBH"{Colors.END}')
-            wb.excel_format_table(self.make_report(df_ipbh), 'IPBH', report_sheets['IPBH'])
+        # if self.process_year.__len__() == 2:
+        #     mask_plan_year = (df_kpi['PLAN_YEAR'] == self.process_year[0]) | (df_kpi['PLAN_YEAR'] == self.process_year[1])
+        # else:
+        #     mask_plan_year = df_kpi['PLAN_YEAR'] == self.process_year[0]
 
-            df_vols = df_kpi[mask_check_plan & mask_vols][report_columns]
-            print(f'Создаем лист отчета: {Colors.GREEN}"ВОЛС"{Colors.END}')
-            wb.excel_format_table(self.make_report(df_vols), 'ВОЛС', report_sheets['ВОЛС'])
+        # mask_check_plan = (df_kpi['CHECK_PLAN'] == 'Да') | (df_kpi['CHECK_FACT'] == 1)
+        # mask_2024_2023_boost = df_kpi['PROGRAM'] == "КФ. Развитие регионов_Ускоренные запуски 2024. 2023"
 
-            df_akb = df_kpi[mask_check_plan & mask_akb][report_columns]
-            print(f'Создаем лист отчета: {Colors.GREEN}"АКБ"{Colors.END}')
-            wb.excel_format_table(self.make_report(df_akb, add_spec=True), 'АКБ', report_sheets['АКБ'])
+        sheet_specs = [spec for spec in SHEET_SPECS if self.args.experimental or not spec.experimental]
+        planner = self.get_planner(df_kpi)
 
+        # Маски и выборки строк вычисляются заранее, в пул передаются только независимые расчеты листов
+        tasks = []
+        if self.args.cube or self.args.stream or self.args.incremental:
+            cube = self.get_cube(df_kpi)
+            for spec in sheet_specs:
+                tasks.append((spec.name, 'make_cube_report', len(cube.planner.rows(spec)), partial(self.make_cube_report, cube, spec, period)))
+        elif self.args.engine == 'polars':
+            # Запросы всех листов выполняются polars за один раз, в пул передаются только готовые таблицы
+            with self.profiler.stage('make_polars_reports', period=period.name, input_rows=len(df_kpi)):
+                reports = self.make_polars_reports(df_kpi, sheet_specs, period)
+            for spec, report in zip(sheet_specs, reports):
+                tasks.append((spec.name, 'make_report', len(planner.rows(spec)), report.copy))
+        else:
+            with self.profiler.stage('make_indicators', period=period.name, input_rows=len(df_kpi)) as record:
+                indicators = self.make_indicators(df_kpi, period)
+                record['rows'] = len(indicators)
+            self.memory.add_frame('Производные таблицы', f'Признаки показателей {period.name}', indicators)
+            for spec in sheet_specs:
+                rows = planner.rows(spec)
+                tasks.append((spec.name, 'make_report', len(rows), partial(self.make_report, df_kpi, divide_prognosis=spec.divide_prognosis, add_spec=spec.add_spec,
+                                                                           rows=rows, indicators=indicators, period=period)))
         if not self.args.dont_save_ap:
-            # Сохраняем АП
-            ap_list = [["АП БС", df_all_bs], ["АП РРЛ", df_rrl], ["АП Энерго", df_energy], ["АП Климатика", df_climate]]
-            if self.args.experimental:
-                ap_list.append(["АП IPBH", df_ipbh])
-                ap_list.append(["АП ВОЛС", df_vols])
-            for sheet_name, df_name in ap_list:
-                mask_prognoz_date = self.make_date_mask(df_name, 'PROGNOZ_DATE', self.begin_date, self.end_date)
-                _df = df_name[mask_prognoz_date].sort_values(by=['RO']).rename(columns=rename_columns)
-                if not _df.empty:
-                    print(f'Создаем лист отчета: {Colors.GREEN}"{sheet_name}"{Colors.END}')
-                    wb.excel_format_table(_df, sheet_name, report_sheets[sheet_name])
+            for spec in sheet_specs:
+                if spec.ap_sheet is not None:
+                    with self.profiler.stage('ap_rows', sheet=spec.ap_sheet, period=period.name, input_rows=len(df_kpi)) as record:
+                        rows = self.ap_rows(df_kpi, spec, period)
+                        record['rows'] = len(rows)
+                    tasks.append((spec.ap_sheet, 'make_ap', len(rows), partial(self.make_ap, df_kpi, rows)))
+
+        def run_task(task: tuple) -> pd.DataFrame:
+            sheet_name, stage, input_rows, func = task
+            with self.profiler.stage(stage, sheet=sheet_name, period=period.name, input_rows=input_rows) as record:
+                frame = func()
+                record['rows'] = len(frame)
+            return frame
+
+        if self.args.jobs > 1:
+            with ThreadPoolExecutor(max_workers=self.args.jobs) as executor:
+                frames = list(executor.map(run_task, tasks))
+        else:
+            frames = [run_task(task) for task in tasks]
+        return [(task[0], frame) for task, frame in zip(tasks, frames)]
+
+    def report_kpi(self, df_kpi: pd.DataFrame, period: ReportPeriod = None,
+                   sheets: list[tuple[str, pd.DataFrame]] = None) -> Union['FormattedWorkbook', 'StreamingWorkbook']:
+        if sheets is None:
+            sheets = self.make_sheets(df_kpi, period)
+
+        wb = self.make_workbook()
+
+        if not self.upload_date.empty:
+            name_of_upload = 'Дата выгрузки данных'
+            self.upload_date = self.upload_date.rename(columns={'DATE_UPLOAD': name_of_upload})
+            print(f'Создаем лист отчета: {Colors.GREEN}"{name_of_upload}"{Colors.END}')
+            wb.excel_format_table(self.upload_date, name_of_upload, self.report_sheets[name_of_upload])
+
+        # Листы записываются последовательно в фиксированном порядке, пустые АП не сохраняются
+        for sheet_name, _df in sheets:
+            self.memory.add_frame(f'Листы {(self.period if period is None else period).name}', sheet_name, _df)
+            if not _df.empty:
+                print(f'Создаем лист отчета: {Colors.GREEN}"{sheet_name}"{Colors.END}')
+                with self.profiler.stage('excel_format_table', sheet=sheet_name, rows=len(_df), columns=len(_df.columns)):
+                    wb.excel_format_table(_df, sheet_name, self.report_sheets[sheet_name])
         return wb
 
-    def save_report(self, wb: FormattedWorkbook) -> None:
+    def make_export_dir(self, period: ReportPeriod) -> Path:
+        """
+        Каталог выгрузки --export за период. В режиме --split-clusters для каждого кластера,
+        а в пакетном режиме для каждого периода создается подкаталог
+        :param period: период анализа
+        :return: путь к каталогу
+        """
+
+        if self.args.export_dir is None:
+            return self.make_report_file(period).with_suffix('')
+        export_dir = Path(self.args.export_dir) if self.cluster is None else Path(self.args.export_dir, self.cluster)
+        if len(self.periods) > 1:
+            return Path(export_dir, period.name)
+        return export_dir
+
+    def export_report(self, sheets: list[tuple[str, pd.DataFrame]], period: ReportPeriod = None) -> None:
+        """
+        Сохраняет листы отчета в форматах --export. Имена файлов совпадают с именами таблиц листов в .xlsx
+        :param sheets: список (имя листа, данные), полученный из make_sheets()
+        :param period: период анализа. None - период из параметров запуска
+        """
+
+        if period is None:
+            period = self.period
+
+        export_dir = self.make_export_dir(period)
+        export_sheets = [(sheet_name, self.report_sheets[sheet_name], _df) for sheet_name, _df in sheets]
+        if not self.upload_date.empty:
+            name_of_upload = 'Дата выгрузки данных'
+            export_sheets.insert(0, (name_of_upload, self.report_sheets[name_of_upload], self.upload_date.rename(columns={'DATE_UPLOAD': name_of_upload})))
+        meta = {
+            'program': PROGRAM_NAME,
+            'version': PROGRAM_VERSION,
+            'begin_date': period.begin_date.date().isoformat(),
+            'end_date': period.end_date.date().isoformat(),
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        print(f'Сохраняем выгрузку {", ".join(self.args.export)} в каталог {Colors.GREEN}"{export_dir}"{Colors.END}')
+        with self.profiler.stage('export_report', period=period.name) as record:
+            files = ReportExporter(self.args.export).export(export_dir, export_sheets, meta)
+            record['files'] = len(files)
+
+    def update_history(self, sheets: list[tuple[str, pd.DataFrame]], period: ReportPeriod = None) -> pd.DataFrame:
+        """
+        Сохраняет сводные таблицы в хранилище истории по дате выгрузки данных и формирует лист 'Динамика':
+        строка ИТОГО: каждого сводного листа по всем сохраненным выгрузкам за тот же период
+        :param sheets: список (имя листа, данные), полученный из make_sheets()
+        :param period: период анализа. None - период из параметров запуска
+        :return: данные листа 'Динамика'
+        """
+
+        if period is None:
+            period = self.period
+
+        report_sheets = [(sheet_name, _df) for sheet_name, _df in sheets if sheet_name in {spec.name for spec in SHEET_SPECS}]
+        upload_date = pd.to_datetime(self.upload_date.iloc[:, 0], errors='coerce').max() if not self.upload_date.empty else pd.NaT
+        if pd.isna(upload_date):
+            print(f'{Colors.YELLOW}Дата выгрузки данных не найдена, сводные таблицы не сохранены в хранилище истории{Colors.END}')
+        else:
+            print(f'Сохраняем сводные таблицы выгрузки {upload_date:%d.%m.%Y %H:%M} в хранилище {Colors.GREEN}"{self.history.path}"{Colors.END}')
+            self.history.save(upload_date, period.begin_date, period.end_date, report_sheets)
+
+        history = self.history.load(period.begin_date, period.end_date, region='ИТОГО:')
+        sheet_names = [sheet_name for sheet_name, _ in report_sheets]
+        # Листы выводятся в порядке отчета, выгрузки каждого листа - по возрастанию даты
+        history = history[history['sheet'].isin(sheet_names) & history['metric'].isin(self.trend_columns)].assign(
+            sheet=lambda _df: pd.Categorical(_df['sheet'], categories=sheet_names))
+        trend = history.pivot_table(index=['sheet', 'upload_date'], columns='metric', values='value', aggfunc='sum', observed=True)
+        trend = trend.reindex(columns=self.trend_columns).reset_index()
+        trend['Прирост факта'] = trend.groupby('sheet', observed=True)['Факт'].diff()
+        trend['sheet'] = trend['sheet'].astype(str)
+        return trend.rename(columns={'sheet': 'Лист', 'upload_date': 'Дата выгрузки'})
+
+    def save_report(self, wb: Union['FormattedWorkbook', 'StreamingWorkbook'], period: ReportPeriod = None) -> None:
+        report_file = self.report_file if period is None else self.make_report_file(period)
         if len(wb.worksheets) != 0:
-            if Path(self.report_file).is_file():
+            if Path(report_file).is_file():
                 try:
-                    print(f'Удаляем старый файл отчета {Colors.GREEN}"{self.report_file}"{Colors.END}')
-                    os.remove(self.report_file)
+                    print(f'Удаляем старый файл отчета {Colors.GREEN}"{report_file}"{Colors.END}')
+                    os.remove(report_file)
                 except Exception as ex:
-                    raise MyLoggingException(f'Не могу удалить файл отчета "{self.report_file}". Ошибка: {ex}')
+                    raise MyLoggingException(f'Не могу удалить файл отчета "{report_file}". Ошибка: {ex}')
             try:
                 logger.info(f'Удаляем лист {wb.active}')
                 wb.remove(wb.active)
-                print(f'Сохраняем отформатированный файл отчета: {Colors.GREEN}"{self.report_file}"{Colors.END}')
-                wb.save(self.report_file)
+                print(f'Сохраняем отформатированный файл отчета: {Colors.GREEN}"{report_file}"{Colors.END}')
+                with self.profiler.stage('save_report', sheets=len(wb.worksheets)) as record:
+                    wb.save(report_file)
+                    record['file_size'] = os.path.getsize(report_file)
             except Exception as ex:
-                raise MyLoggingException(f'Не могу сохранить файл отчета "{self.report_file}". Ошибка: {ex}')
+                raise MyLoggingException(f'Не могу сохранить файл отчета "{report_file}". Ошибка: {ex}')
+
+
+def make_reports(wr: WeeklyReport, df: dict[str, pd.DataFrame]) -> None:
+    """
+    Формирует и сохраняет отчеты за все периоды из одной загрузки данных
+    :param wr: параметры отчета
+    :param df: словарь {имя листа: данные}
+    """
+
+    if wr.args.split_clusters and wr.cluster is None:
+        make_cluster_reports(wr, df)
+        return
+    if df.__len__() > 1:
+        wr.upload_date = df[wr.sheets[1]]
+    for period in wr.periods:
+        if len(wr.periods) > 1:
+            print(f'Формируем отчет за период: {Colors.GREEN}{period.name}{Colors.END}')
+        sheets = wr.make_sheets(df[wr.sheets[0]], period)
+        if wr.args.history:
+            sheets.append(('Динамика', wr.update_history(sheets, period)))
+        if wr.args.incremental and wr.changes is not None:
+            sheets.append(('Изменения', wr.changes))
+        if wr.args.export is not None:
+            wr.export_report(sheets, period)
+        if not wr.args.no_xlsx:
+            work_book = wr.report_kpi(df[wr.sheets[0]], period, sheets)
+            wr.save_report(work_book, period)
+
+
+# Параметры отчета и данные процесса пула --split-clusters, задаются init_cluster_worker
+_cluster_worker: tuple[WeeklyReport, dict[str, pd.DataFrame]] = None
+
+
+def init_cluster_worker(argv: list[str], df: dict[str, pd.DataFrame]) -> None:
+    """
+    Инициализация процесса пула --split-clusters: данные передаются в процесс один раз и используются для всех его кластеров
+    :param argv: параметры запуска программы
+    :param df: словарь {имя листа: данные}
+    """
+
+    global _cluster_worker
+    # Кэш уже очищен основным процессом
+    _cluster_worker = (WeeklyReport([arg for arg in argv if arg != '--clear-cache']), df)
+
+
+def make_cluster_report(cluster: str) -> str:
+    """
+    Формирует отчеты кластера за все периоды в процессе пула --split-clusters
+    :param cluster: кластер (RO_CLUSTER)
+    :return: кластер
+    """
+
+    wr, df = _cluster_worker
+    wr.cluster = cluster
+    _df = df[wr.sheets[0]]
+    make_reports(wr, {**df, wr.sheets[0]: _df[(_df['RO_CLUSTER'] == cluster).to_numpy(dtype=bool)]})
+    return cluster
+
+
+def make_cluster_reports(wr: WeeklyReport, df: dict[str, pd.DataFrame]) -> None:
+    """
+    Формирует отчеты всех кластеров (--split-clusters) параллельно в пуле процессов
+    :param wr: параметры отчета
+    :param df: словарь {имя листа: данные}
+    """
+
+    rows = df[wr.sheets[0]]['RO_CLUSTER'].value_counts()
+    rows = rows[rows > 0]
+    clusters = [cluster for cluster in wr.ro_cluster['RO_CLUSTER'].unique() if cluster in rows.index]
+    skipped = rows[~rows.index.isin(wr.ro_cluster['RO_CLUSTER'])]
+    if not skipped.empty:
+        print(f'{Colors.YELLOW}Кластеры не найдены в справочнике кластеров, отчеты не формируются: '
+              f'{", ".join(f"{cluster} ({count} строк)" for cluster, count in skipped.items())}{Colors.END}')
+    if not clusters:
+        print(f'{Colors.RED}В данных нет строк кластеров из справочника, отчеты кластеров не сформированы{Colors.END}')
+        return
+    print(f'Формируем отчеты кластеров: {Colors.GREEN}{", ".join(clusters)}{Colors.END}')
+    with wr.profiler.stage('make_cluster_reports', clusters=len(clusters)):
+        with ProcessPoolExecutor(max_workers=min(len(clusters), os.cpu_count() or 1), initializer=init_cluster_worker, initargs=(wr.argv, df)) as executor:
+            for cluster in executor.map(make_cluster_report, clusters):
+                print(f'Отчет кластера {Colors.GREEN}{cluster}{Colors.END} сформирован')
+
+
+def load_data(wr: WeeklyReport, check_age: bool = True) -> dict[str, pd.DataFrame]:
+    """ Загружает данные с замером этапа get_data """
+    with wr.profiler.stage('get_data') as record:
+        df = wr.get_data(check_age)
+        record['rows'] = len(df[wr.sheets[0]])
+        record['columns'] = len(df[wr.sheets[0]].columns)
+    return df
+
+
+def watch(wr: WeeklyReport) -> None:
+    """
+    Режим ожидания: данные держатся в памяти, отчеты пересоздаются после каждого изменения файла с данными.
+    Ошибки обработки одного изменения не останавливают ожидание следующего
+    :param wr: параметры отчета
+    """
+
+    watcher = SourceWatcher(wr.urls, interval=wr.args.watch_interval)
+    while True:
+        watcher.wait_for_change()
+        print(f'{Colors.DARKCYAN}{datetime.datetime.now().strftime("%d.%m.%Y %H:%M:%S")}:{Colors.END} Обрабатываем файлы {Colors.GREEN}{", ".join(map(str, wr.urls))}{Colors.END}')
+        try:
+            if wr.default_period:
+                # Ожидание может продолжаться после окончания месяца запуска: период по умолчанию определяется заново
+                urls = wr.urls
+                wr.set_period(datetime.date.today())
+                wr.report_file = wr.make_report_file(wr.period)
+                if wr.urls != urls:
+                    watcher = SourceWatcher(wr.urls, interval=wr.args.watch_interval)
+                    watcher.wait_for_change()
+            if wr.check_data_age():
+                previous_data = wr.data
+                df = load_data(wr, check_age=False)
+                if df is not previous_data:
+                    make_reports(wr, df)
+        except Exception as ex:
+            # Файл может быть выложен не полностью или с ошибками: ждем следующего изменения
+            print(f'{Colors.RED}Ошибка формирования отчета: {ex}{Colors.END}')
+        print(f'Ожидаем изменения файлов {Colors.GREEN}{", ".join(map(str, wr.urls))}{Colors.END}')
+
+
+def report_memory(wr: WeeklyReport) -> None:
+    """ Выводит объем памяти загруженных данных, выборок строк и таблиц отчета """
+    if wr.data is not None:
+        for sheet_name, _df in wr.data.items():
+            wr.memory.add_frame('Исходные данные', sheet_name, _df, by_column=sheet_name == wr.sheets[0])
+    if wr.planner is not None:
+        wr.memory.add('Выборки строк', 'Маски и позиции строк листов', wr.planner.nbytes)
+    if wr.cube is not None:
+        wr.memory.add('Выборки строк', f'Накопительные счетчики дат ({len(wr.cube.groups)} групп)', wr.cube.nbytes)
+    print('Объем памяти:')
+    for line in wr.memory.lines():
+        print(line)
 
 
 def main():
     locale.setlocale(locale.LC_ALL, '')
+    Colors.enable()
     wr = WeeklyReport()
     print(f'{Colors.DARKCYAN}{datetime.datetime.now().strftime("%d.%m.%Y %H:%M:%S")}:{Colors.END} {PROGRAM_NAME} v.{PROGRAM_VERSION}')
-    df = wr.get_data()
-    if df.__len__() > 1:
-        wr.upload_date = df[wr.sheets[1]]
-    work_book = wr.report_kpi(df[wr.sheets[0]])
-    wr.save_report(work_book)
+    if wr.args.serve is not None:
+        try:
+            ReportServer(wr).serve(wr.args.host, wr.args.serve)
+        except KeyboardInterrupt:
+            print('Сервис выборок остановлен')
+    elif wr.args.watch:
+        try:
+            watch(wr)
+        except KeyboardInterrupt:
+            print('Режим ожидания остановлен')
+    else:
+        make_reports(wr, load_data(wr))
+    if wr.memory.enabled:
+        report_memory(wr)
+    if wr.args.memory_budget is not None:
+        process_peak = peak_rss()
+        if process_peak is not None and process_peak > wr.args.memory_budget * 2 ** 20:
+            print(f'{Colors.RED}Пиковый объем памяти {process_peak / 2 ** 20:.0f} МБ превысил допустимый {wr.args.memory_budget:.0f} МБ{Colors.END}')
+    if wr.profiler.enabled:
+        wr.profiler.save(wr.args.profile)
+        print(f'Замеры этапов сохранены в файл {Colors.GREEN}"{wr.args.profile}"{Colors.END}')
+        for line in wr.profiler.summary():
+            print(line)
 
 
 if __name__ == '__main__':
+    # Процессы пула --split-clusters в собранной программе запускаются тем же исполняемым файлом
+    multiprocessing.freeze_support()
     main()